@@ -858,6 +858,11 @@ async def invoices_cron():
             else:
                 logger.info(f"No invoices to insert for period: {period_description}")
 
+            # Lazy import: routes import this module, so a top-level import would cycle.
+            from ..routes.customer_analytics import clear_customer_analytics_cache
+
+            clear_customer_analytics_cache()
+
             duration = time.time() - start_time
 
             # Send success notification
@@ -3289,6 +3294,24 @@ async def bank_transactions_cron():
         )
 
 
+async def books_token_refresh_cron():
+    """Keep the shared Books access token warm.
+
+    The shared token cache treats a token as expired five minutes before Zoho
+    does. Running every few minutes, this mints the replacement inside that
+    window, so customer approvals and webhooks find a valid token in the cache
+    (in process or in Mongo) instead of waiting on the OAuth grant themselves.
+    If a run is missed they still refresh inline, as before.
+    """
+    # Lazy import: routes import this module, so a top-level import would cycle.
+    from ..routes.helpers import get_access_token
+
+    try:
+        await asyncio.to_thread(get_access_token, "books")
+    except Exception as e:
+        logger.warning(f"Books token refresh failed: {e}")
+
+
 def setup_cron_jobs(scheduler_instance: AsyncIOScheduler):
     """Setup all cron jobs with the provided scheduler."""
     try:
@@ -3468,6 +3491,18 @@ def setup_cron_jobs(scheduler_instance: AsyncIOScheduler):
         )
         logger.info("Added bank_transactions_cron job")
 
+        scheduler_instance.add_job(
+            books_token_refresh_cron,
+            "interval",
+            minutes=4,
+            id="books_token_refresh_cron",
+            replace_existing=True,
+            misfire_grace_time=60,
+            coalesce=True,
+            max_instances=1,
+        )
+        logger.info("Added books_token_refresh_cron job")
+
         logger.info(
             f"✅ {len(scheduler_instance.get_jobs())} cron jobs set up successfully"
         )
@@ -46,15 +46,24 @@ def get_client():
         if not mongo_uri:
             raise ConnectionError("MONGO_URI environment variable not set")
 
-        # Optimized connection pool settings for better performance
+        # Optimized connection pool settings for better performance. One
+        # client (and pool) per process, shared by every router; sync handlers
+        # run on FastAPI's threadpool (40 threads), so the default max keeps a
+        # connection free for each. Tunable per deployment.
         _mongo_client = MongoClient(
             mongo_uri,
-            maxPoolSize=50,  # Maximum connections in the pool
-            minPoolSize=10,  # Minimum connections to maintain
+            # Maximum connections in the pool
+            maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+            # Minimum connections to maintain
+            minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "10")),
             maxIdleTimeMS=50000,  # Max idle time before closing connection
             socketTimeoutMS=20000,  # Socket timeout
             connectTimeoutMS=20000,  # Connection timeout
-            serverSelectionTimeoutMS=5000  # Server selection timeout
+            serverSelectionTimeoutMS=5000,  # Server selection timeout
+            # Wire compression for large result sets (analytics, exports).
+            # zlib ships with Python; zstd/snappy need extra packages, so
+            # they are opt-in via MONGO_COMPRESSORS.
+            compressors=os.getenv("MONGO_COMPRESSORS", "zlib"),
         )
         _mongo_db = _mongo_client.get_database(db_name)
 
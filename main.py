@@ -65,6 +65,8 @@ app.add_middleware(
         "OPTIONS",
     ],  # Specify allowed methods
     allow_headers=["*"],
+    # Set when customer analytics falls back to an earlier response
+    expose_headers=["X-Analytics-Stale"],
 )
 
 # Include API router
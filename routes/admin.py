@@ -13,6 +13,10 @@ from fastapi.responses import JSONResponse, Response, StreamingResponse
 from ..config.root import get_client, get_database, serialize_mongo_document
 from bson.objectid import ObjectId
 from .helpers import get_access_token, fetch_overdue_invoices, fetch_associated_credit_notes
+from .customer_analytics import (
+    ANALYTICS_CUSTOMER_FIELDS,
+    clear_customer_analytics_cache,
+)
 from typing import Optional, List
 import re, requests, os, json, time, boto3, io, csv, openpyxl
 from dotenv import load_dotenv
@@ -2794,6 +2798,8 @@ async def bulk_update_customers(payload: dict):
         if result.matched_count == 0:
             results.append({"customer_id": customer_id, "status": "not found"})
             continue
+        if ANALYTICS_CUSTOMER_FIELDS.intersection(update_data):
+            clear_customer_analytics_cache()
 
         updated_count += 1
         results.append(
@@ -12,6 +12,7 @@ Approval status (PENDING -> APPROVED/REJECTED/...) is updated two ways:
      /api/chats/callback already stores WABA events; see apply_template_status).
 """
 import datetime
+import time
 from fastapi import APIRouter, Body, HTTPException, Query
 from bson import ObjectId
 
@@ -31,6 +32,32 @@ def _now():
     return datetime.datetime.now()
 
 
+# ---------------------------------------------------------------------------
+# Send-path lookups
+# ---------------------------------------------------------------------------
+
+# Templates by name for the send path, which looks the same few up on every
+# comment / status change. Every write below clears it; the TTL covers edits
+# made outside this module.
+_TEMPLATE_CACHE_TTL_SECONDS = 300
+_template_cache = {}
+
+
+def get_template_by_name(name: str):
+    """db.templates.find_one({"name": name}), served from memory for up to
+    _TEMPLATE_CACHE_TTL_SECONDS. Callers must not mutate the result."""
+    entry = _template_cache.get(name)
+    if entry and time.monotonic() - entry[0] < _TEMPLATE_CACHE_TTL_SECONDS:
+        return entry[1]
+    template = templates_col.find_one({"name": name})
+    _template_cache[name] = (time.monotonic(), template)
+    return template
+
+
+def clear_template_cache():
+    _template_cache.clear()
+
+
 # ---------------------------------------------------------------------------
 # Read
 # ---------------------------------------------------------------------------
@@ -124,6 +151,7 @@ def create_template(payload: dict = Body(...)):
         "updated_at": _now(),
     }
     result = templates_col.insert_one(doc)
+    clear_template_cache()
     doc["_id"] = result.inserted_id
     return {"data": serialize_mongo_document(doc), "plivo_response": resp}
 
@@ -171,6 +199,7 @@ def update_template(template_id: str, payload: dict = Body(...)):
             raise HTTPException(status_code=502, detail=str(e))
 
     templates_col.update_one({"_id": doc["_id"]}, {"$set": set_fields})
+    clear_template_cache()
     updated = templates_col.find_one({"_id": doc["_id"]})
     return {"data": serialize_mongo_document(updated)}
 
@@ -200,6 +229,7 @@ def delete_template(template_id: str):
             raise HTTPException(status_code=502, detail=str(e))
 
     templates_col.delete_one({"_id": doc["_id"]})
+    clear_template_cache()
     return {"status": "deleted"}
 
 
@@ -233,6 +263,7 @@ def sync_templates():
         res = templates_col.update_one({"name": name}, {"$set": set_fields})
         if res.modified_count:
             updated += 1
+    clear_template_cache()
 
     return {"status": "ok", "remote_count": len(remote), "updated": updated}
 
@@ -266,3 +297,4 @@ def apply_template_status(name: str, status: str, rejected_reason: str = None):
     if rejected_reason:
         set_fields["rejected_reason"] = rejected_reason
     templates_col.update_one({"name": name}, {"$set": set_fields})
+    clear_template_cache()
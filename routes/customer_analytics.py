@@ -1,9 +1,16 @@
 from fastapi import APIRouter, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from typing import Optional
 
-import logging
-from ..config.root import get_database, serialize_mongo_document
+import asyncio, logging, threading, time
+import bson, orjson
+from bson.raw_bson import RawBSONDocument
+from collections import namedtuple
+from functools import lru_cache
+from itertools import islice
+from datetime import date, datetime, timedelta, timezone
+from pymongo.errors import ExecutionTimeout, OperationFailure
+from ..config.root import get_database
 
 router = APIRouter()
 
@@ -11,1315 +18,977 @@ logger = logging.getLogger(__name__)
 logger.propagate = False
 
 db = get_database()
-@router.get("")
-def get_customer_analytics(
-    status: Optional[str] = Query(None, description="Filter by invoice status"),
-    tier: Optional[str] = Query(None, description="Filter by tiers (A,B,C)"),
-    due_status: Optional[str] = Query("all", description="Filter by Payments Due (all, due, not_due)"),
-    last_billed: Optional[str] = Query(
-        "all", description="Filter by last billing activity (all, last_month, last_45_days, last_2_months, last_3_months, not_last_month, not_last_45_days, not_last_2_months, not_last_3_months)"
-    ),
-    sp_code: Optional[str] = Query(None, description="Filter by salesperson code"),
-    sort_by: Optional[bool] = Query(True, description="Low to High or High to Low"),
-):
+
+# The first $match filters on status, an ISO date string range and the
+# customer_name regex; with all three in one index the server can reject
+# excluded statuses and names from the keys before fetching any invoice. A
+# status / tier filter adds a customer_id $in, served by the second index. The
+# customers lookup runs once per grouped row, keyed on contact_id, and the
+# status / tier allow-list is read straight off the (status, cf_tier,
+# contact_id) index without fetching customer documents.
+try:
+    db.invoices.create_index(
+        [("status", 1), ("date", 1), ("customer_name", 1)],
+        name="analytics_match",
+    )
+    db.invoices.create_index([("customer_id", 1), ("date", 1)])
+    db.customers.create_index("contact_id")
+    db.customers.create_index([("status", 1), ("cf_tier", 1), ("contact_id", 1)])
+except Exception:
+    pass
+
+# Rows pulled from the server per getMore while streaming the response. The
+# result set is one row per customer address, so a batch this size usually
+# covers the whole response in a round trip or two.
+_CURSOR_BATCH_SIZE = 5000
+
+# Rows handed to each orjson.dumps call while streaming.
+_ENCODE_CHUNK_SIZE = 500
+
+# Finished responses, keyed by the query parameters. Every date window in the
+# pipeline is relative to today, so an entry only counts as fresh on the day
+# it was built. Invoices only change via the Zoho webhooks (create, update,
+# delete) and the invoice resync cron, and all of them invalidate the cache, as
+# do writes to the customer fields the endpoint reads (ANALYTICS_CUSTOMER_FIELDS)
+# and customer inserts/deletes, so the TTL just bounds staleness from writes
+# that go around them.
+#
+# Invalidation bumps a generation counter rather than dropping entries: a stale
+# body is still the best answer when the aggregation itself fails (see
+# get_customer_analytics), as long as it was built today and is no older than
+# _ANALYTICS_STALE_MAX_AGE_SECONDS.
+_ANALYTICS_CACHE_TTL_SECONDS = 3600
+_ANALYTICS_STALE_MAX_AGE_SECONDS = 6 * 3600
+# sp_code is free text, so the key space is open-ended; past this many bodies
+# the oldest stored one is dropped.
+_ANALYTICS_CACHE_MAX_ENTRIES = 512
+_analytics_cache: dict = {}
+_analytics_cache_generation = 0
+_analytics_cache_lock = threading.Lock()
+
+# Server errors for an aggregation that ran out of memory rather than failed
+# outright: 292 QueryExceededMemoryLimitNoDiskUseAllowed, 16819 sort limit,
+# 16945 $group limit (pre-4.4 servers).
+_MEMORY_LIMIT_ERROR_CODES = {292, 16819, 16945}
+
+
+# Customer fields the analytics read (via the customers $lookup) and filter on
+# (status / tier); writes touching any of them must clear the cache.
+ANALYTICS_CUSTOMER_FIELDS = frozenset({"status", "cf_tier"})
+
+
+def clear_customer_analytics_cache():
+    """Mark every cached analytics response stale. Call after invoices change."""
+    global _analytics_cache_generation
+    with _analytics_cache_lock:
+        _analytics_cache_generation += 1
+
+
+def _cached_response(key):
+    with _analytics_cache_lock:
+        entry = _analytics_cache.get(key)
+        generation = _analytics_cache_generation
+    if (
+        entry
+        and entry[0] == generation
+        and entry[1] == date.today()
+        and time.time() - entry[2] < _ANALYTICS_CACHE_TTL_SECONDS
+    ):
+        return entry[3]
+    return None
+
+
+def _stale_response(key):
+    """(body, built_at) for the last body built for `key`, or None.
+
+    Only bodies built today qualify, since the date windows in older ones no
+    longer match the current month, and only up to
+    _ANALYTICS_STALE_MAX_AGE_SECONDS old.
+    """
+    with _analytics_cache_lock:
+        entry = _analytics_cache.get(key)
+    if (
+        entry
+        and entry[1] == date.today()
+        and time.time() - entry[2] < _ANALYTICS_STALE_MAX_AGE_SECONDS
+    ):
+        return entry[3], entry[2]
+    return None
+
+
+def _current_generation():
+    with _analytics_cache_lock:
+        return _analytics_cache_generation
+
+
+def _cache_stream(key, generation, chunks):
+    """Pass `chunks` through and cache the full body once it has all been sent.
+
+    A client that disconnects mid-stream closes the generator before the end,
+    so a partial body is never cached. `generation` must be read before the
+    aggregation starts, so a body built while invoices were changing is
+    already stale when stored.
+    """
+    today = date.today()
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    with _analytics_cache_lock:
+        # Re-inserting keeps the dict in storage order, oldest first
+        _analytics_cache.pop(key, None)
+        if len(_analytics_cache) >= _ANALYTICS_CACHE_MAX_ENTRIES:
+            del _analytics_cache[next(iter(_analytics_cache))]
+        _analytics_cache[key] = (generation, today, time.time(), b"".join(body))
+
+
+def _aggregate(pipeline):
+    # The $group holds every matched invoice in allInvoices; let it spill to
+    # disk rather than fail on servers that do not allow that by default.
+    return db.invoices.aggregate(
+        pipeline, batchSize=_CURSOR_BATCH_SIZE, allowDiskUse=True
+    )
+
+
+# Amounts and rates returned to 2 decimal places. Rounded here, on the few
+# rows that come back, rather than with $round in the final $project; the
+# shipping address is likewise formatted here rather than with $concat.
+_ROUNDED_FIELDS = (
+    "totalSalesCurrentMonth",
+    "averageOrderFrequencyMonthly",
+    "billingTillDateCurrentYear",
+    "totalSalesLastFY",
+    "totalSalesPreviousFY",
+)
+
+
+def _format_address(address):
+    """Shipping address as one line: "street, street2, city, state - zip",
+    skipping empty parts after the street."""
+    address = address or {}
+    parts = [address.get("street") or ""]
+    parts.extend(
+        address[key]
+        for key in ("street2", "city", "state")
+        if address.get(key)
+    )
+    formatted = ", ".join(parts)
+    if address.get("zip"):
+        formatted += f" - {address['zip']}"
+    return formatted
+
+
+def _finish_row(doc):
+    """Round the amounts and format the address of one result row."""
+    for field in _ROUNDED_FIELDS:
+        value = doc.get(field)
+        if value is not None:
+            doc[field] = round(value, 2)
+    doc["shippingAddress"] = _format_address(doc.get("shippingAddress"))
+    return doc
+
+
+def _stream_json_array(cursor):
+    """Encode an aggregation cursor as a JSON array, one document at a time.
+
+    Rows are encoded in chunks with orjson. The pipeline already emits
+    invoice ids as strings, so no value needs a Python fallback; `default=str`
+    only guards against a stray ObjectId. That is everything
+    serialize_mongo_document used to do, done in C instead of a per-field
+    Python walk.
+    """
     try:
+        docs = map(_finish_row, cursor)
+        yield b"["
+        first = True
+        while True:
+            batch = list(islice(docs, _ENCODE_CHUNK_SIZE))
+            if not batch:
+                break
+            # One dumps call per chunk of rows; drop its brackets to splice it
+            # into the outer array.
+            chunk = orjson.dumps(batch, default=str)[1:-1]
+            yield chunk if first else b"," + chunk
+            first = False
+        yield b"]"
+    finally:
+        cursor.close()
 
-        # Build the match stage dynamically
-        match_stage = {
-            "date": {"$gte": "2023-04-01"},
-            "status": {"$nin": ["void", "draft"]},
-            "$and": [
-                {
-                    "customer_name": {
-                        "$not": {
-                            "$regex": r"\b(EC|NA|PUPEV|RS|MKT|SPUR|SSAM|OSAMP)\b",
-                            "$options": "i",
-                        }
-                    }
-                },
-                {
-                    "customer_name": {
-                        "$not": {
-                            "$regex": r"(amzb2b|amz2b2|Blinkit|Flipkart)",
-                            "$options": "i",
-                        }
-                    }
-                },
-            ],
+
+def _stream_ndjson(cursor):
+    """Encode an aggregation cursor as newline-delimited JSON, one row per line,
+    so clients can parse customer by customer instead of buffering an array.
+    """
+    try:
+        docs = map(_finish_row, cursor)
+        while True:
+            batch = list(islice(docs, _ENCODE_CHUNK_SIZE))
+            if not batch:
+                break
+            yield b"".join(
+                orjson.dumps(doc, default=str, option=orjson.OPT_APPEND_NEWLINE)
+                for doc in batch
+            )
+    finally:
+        cursor.close()
+
+
+def _month_start(year, month, months_back=0):
+    """First day of the month `months_back` months before (year, month), as
+    an ISO "YYYY-MM-DD" string comparable with the invoice `date` field."""
+    index = year * 12 + (month - 1) - months_back
+    return f"{index // 12}-{index % 12 + 1:02d}-01"
+
+
+# Earliest invoice the analytics look at. Deliberately not tied to the oldest
+# FY window: lastBillDate, the due-payment lists and allInvoices all reach back
+# past it, so tightening this would drop long-idle customers and their overdue
+# invoices from the response.
+ANALYTICS_START_DATE = "2023-04-01"
+
+# Internal / marketplace accounts kept out of the analytics: a customer_name
+# containing any of these codes as a whole word, or any of the marketplace
+# names anywhere. One positive regex with a lookahead, so each name is scanned
+# once instead of once per $not clause.
+EXCLUDED_CUSTOMER_NAME_PATTERN = (
+    r"^(?!.*(?:\b(?:EC|NA|PUPEV|RS|MKT|SPUR|SSAM|OSAMP)\b"
+    r"|amzb2b|amz2b2|Blinkit|Flipkart))"
+)
+
+# Invoice statuses that rule an invoice out of the due / not-due payment lists
+DUE_EXCLUDED_STATUSES = ["void", "draft", "sent", "paid"]
+NOT_DUE_EXCLUDED_STATUSES = ["void", "overdue", "partially_paid"]
+
+
+def _payments_excluding(invoices, excluded_statuses):
+    """Aggregation expression: the payment view of every invoice in the
+    `invoices` array whose status is not in `excluded_statuses`.
+
+    The due and not-due lists are both cut from the per-customer allInvoices
+    array after grouping, so $group only has to collect each invoice once.
+    """
+    return {
+        "$map": {
+            "input": {
+                "$filter": {
+                    "input": invoices,
+                    "cond": {"$not": {"$in": ["$$this.status", excluded_statuses]}},
+                }
+            },
+            "in": {
+                "_id": "$$this._id",
+                "date": "$$this.date",
+                "due_date": "$$this.due_date",
+                "invoice_number": "$$this.invoice_number",
+                "status": "$$this.status",
+                "invoice_id": "$$this.invoice_id",
+                "total": "$$this.total",
+                "balance": "$$this.balance",
+            },
         }
-        customer_status_match_stage = {}
-        sort_stage = {"$sort": {"totalSalesCurrentMonth": 1}}
-
-        # Add status filter if provided, otherwise use default exclusions
-        if status == "all":
-            pass
-        elif status:
-            customer_status_match_stage["customerDetails.status"] = status
-
-        # Add salesperson filter if provided
-        if sp_code:
-            match_stage["$or"] = [
-                {"salesperson_name": sp_code},
-                {"cf_sales_person": sp_code},
-            ]
+    }
 
-        if sort_by:
-            sort_stage["$sort"] = [
-                {"totalSalesCurrentMonth": -1},
-            ]
 
-        # Create the salesPerson field logic based on whether sp_code is provided
-        if sp_code:
-            # If sp_code is provided, return the field that matches the sp_code
-            sales_person_logic = {
-                "$cond": [
-                    {"$eq": ["$salesperson_name", sp_code]},
-                    "$salesperson_name",
-                    {
-                        "$cond": [
-                            {"$eq": ["$cf_sales_person", sp_code]},
-                            "$cf_sales_person",
-                            # Fallback to first non-null if neither matches (shouldn't happen due to filter)
-                            {
-                                "$cond": [
-                                    {"$ne": ["$salesperson_name", None]},
-                                    "$salesperson_name",
-                                    "$cf_sales_person",
-                                ]
-                            },
-                        ]
-                    },
-                ]
+def _customer_filter(status, tier):
+    """Filter on the customers collection for the status / tier query params,
+    or None when neither narrows the result."""
+    customer_filter = {}
+    # status "all" (or none) keeps every customer
+    if status and status != "all":
+        customer_filter["status"] = status
+    if tier and len(tier) == 1:
+        customer_filter["cf_tier"] = {"$regex": f"^{tier}$", "$options": "i"}
+    return customer_filter or None
+
+
+def _matching_customer_ids(customer_filter):
+    """contact_ids of the customers matching `customer_filter`.
+
+    Filtering customers before the invoice pipeline, rather than with a
+    $match after the customers $lookup, means invoices of other customers
+    are never read, grouped or joined.
+    """
+    return db.customers.distinct("contact_id", customer_filter)
+
+
+def _last_billed_stages(last_billed, windows, last_45_days_start):
+    """$match for the last_billed filter, run straight after the $group.
+
+    Every window runs up to today, so "billed in the window" only depends on
+    the customer's latest invoice (or, for last month, the hasBilledLastMonth
+    flag the group computes). That makes each option a plain field test
+    decided here, rather than an $expr testing the last_billed literal for
+    every customer.
+    """
+    if last_billed == "all":
+        return []
+    window_starts = {
+        "last_45_days": last_45_days_start,
+        "last_2_months": windows.last_2_months_start,
+        "last_3_months": windows.last_3_months_start,
+    }
+    negated = last_billed.startswith("not_") if last_billed else False
+    window = last_billed[len("not_"):] if negated else last_billed
+    if window == "last_month":
+        condition = {"hasBilledLastMonth": not negated}
+    elif window in window_starts:
+        operator = "$lt" if negated else "$gte"
+        condition = {"lastBillDate": {operator: window_starts[window]}}
+    else:
+        # Anything else never matched a customer
+        condition = {"$expr": False}
+    return [{"$match": condition}]
+
+
+def _due_status_stages(due_status):
+    """Build the payment lists due_status asks for and, unless it is "all",
+    keep only customers whose list is non-empty.
+
+    due_status is known before the query runs, so the choice of lists and
+    whether to filter is made here instead of with $cond / $expr on a literal
+    for every customer. The invoice-level status test cannot move into the
+    first $match: totals and allInvoices still need every invoice.
+    """
+    due_payments = (
+        _payments_excluding("$allInvoices", DUE_EXCLUDED_STATUSES)
+        if due_status in ("all", "due")
+        else []
+    )
+    not_due_payments = (
+        _payments_excluding("$allInvoices", NOT_DUE_EXCLUDED_STATUSES)
+        if due_status in ("all", "not_due")
+        else []
+    )
+    stages = [
+        {
+            "$addFields": {
+                "filteredDuePayments": due_payments,
+                "filteredNotDuePayments": not_due_payments,
             }
-        else:
-            # If no sp_code filter, use the original logic
-            sales_person_logic = {
-                "$cond": [
-                    {"$ne": ["$salesperson_name", None]},
-                    "$salesperson_name",
-                    "$cf_sales_person",
-                ]
+        }
+    ]
+    if due_status == "due":
+        # Only customers with due payments
+        stages.append({"$match": {"filteredDuePayments.0": {"$exists": True}}})
+    elif due_status == "not_due":
+        # Only customers with not due payments
+        stages.append({"$match": {"filteredNotDuePayments.0": {"$exists": True}}})
+    elif due_status != "all":
+        # Anything else never matched a customer
+        stages.append({"$match": {"$expr": False}})
+    return stages
+
+
+def _encoded(stage):
+    """Pre-encode a pipeline stage shared across requests. pymongo copies a
+    RawBSONDocument into the aggregate command as-is instead of walking and
+    re-encoding the nested dicts every time."""
+    return RawBSONDocument(bson.encode(stage))
+
+
+def _in_range(field, start, end):
+    """Aggregation expression: start <= field < end."""
+    return {"$and": [{"$gte": [field, start]}, {"$lt": [field, end]}]}
+
+
+# Pipeline fragments that do not depend on the request. They are built once at
+# import and shared by every pipeline, so a request only assembles the parts
+# that vary: the filters and the date windows.
+
+# Normalize city name to handle variations (with null handling) - Updated to
+# use shipping_address. Spellings of the same city map to one canonical name;
+# anything else is just lower-cased.
+CITY_ALIASES = {
+    "bengaluru": ["bangalore", "bengaluru"],
+    "mumbai": ["mumbai", "bombay"],
+    "delhi": ["delhi", "new delhi"],
+}
+
+# Lower-case once, then plain equality against each alias list, instead of a
+# case-insensitive $regexMatch per branch
+_NORMALIZED_CITY = {
+    "$let": {
+        "vars": {
+            "city": {
+                "$toLower": {"$ifNull": ["$shipping_address.city", "unknown_city"]}
+            }
+        },
+        "in": {
+            "$switch": {
+                "branches": [
+                    {"case": {"$in": ["$$city", aliases]}, "then": canonical}
+                    for canonical, aliases in CITY_ALIASES.items()
+                ],
+                "default": "$$city",
             }
+        },
+    }
+}
 
-        if tier and len(tier) == 1:
-            customer_status_match_stage["customerDetails.cf_tier"] = {
-                "$regex": f"^{tier}$",
-                "$options": "i",
+# status and tier are read from the first matching customer record, so the
+# join stops at one match and carries just those two fields instead of whole
+# customer documents.
+_CUSTOMER_DETAILS_LOOKUP = _encoded(
+    {
+        "$lookup": {
+            "from": "customers",
+            "localField": "_id.customerId",
+            "foreignField": "contact_id",
+            "pipeline": [
+                {"$limit": 1},
+                {"$project": {"_id": 0, "status": 1, "cf_tier": 1}},
+            ],
+            "as": "customerDetails",
+        }
+    }
+)
+
+
+# Invoice fields the pipeline reads after the first $match. Everything else on
+# a Zoho invoice (line items, custom fields, taxes, ...) is dropped before the
+# per-invoice stages run.
+_INVOICE_FIELDS_STAGE = _encoded(
+    {
+        "$project": {
+            "invoice_number": 1,
+            "invoice_id": 1,
+            "date": 1,
+            "due_date": 1,
+            "status": 1,
+            "total": 1,
+            "balance": 1,
+            "customer_id": 1,
+            "customer_name": 1,
+            "salesperson_name": 1,
+            "cf_sales_person": 1,
+            "shipping_address.street": 1,
+            "shipping_address.street2": 1,
+            "shipping_address.city": 1,
+            "shipping_address.state": 1,
+            "shipping_address.zip": 1,
+            "shipping_address.country": 1,
+        }
+    }
+)
+
+# Stages 7-8, the same for every request
+_OUTPUT_STAGES = [
+    _encoded(stage)
+    for stage in [
+        # Stage 7: Project final output format
+        {
+            "$project": {
+                "_id": 0,
+                "customerName": 1,
+                # Formatted while streaming (see _format_address)
+                "shippingAddress": 1,
+                "status": "$customerStatus",
+                "tier": "$customerTier",
+                # Rounded while streaming (see _ROUNDED_FIELDS)
+                "totalSalesCurrentMonth": 1,
+                "lastBillDate": 1,
+                "averageOrderFrequencyMonthly": 1,
+                "billingTillDateCurrentYear": 1,
+                "totalSalesLastFY": 1,
+                "totalSalesPreviousFY": 1,
+                "salesPerson": 1,
+                "hasBilledLastMonth": 1,
+                "hasBilledLast45Days": 1,
+                "hasBilledLast2Months": 1,
+                "hasBilledLast3Months": 1,
+                # Include payment lists
+                "duePayments": "$filteredDuePayments",
+                "notDuePayments": "$filteredNotDuePayments",
+                
+                # NEW: Include all invoices for validation
+                "allInvoices": 1,
+                
+                # Additional fields for validation
+                "totalInvoiceCount": {
+                    "$size": "$allInvoices"
+                },
+                "currentFYInvoiceCount": "$currentFYOrders"
             }
+        },
+        # Stage 8: Sort by customer name
+        {"$sort": {"customerName": 1}},
+    ]
+]
 
-        # Get current date for dynamic calculations
-        from datetime import datetime
-
-        current_date = datetime.now()
-        current_year = current_date.year
-        current_month = current_date.month
-
-        # Calculate current financial year
-        if current_month >= 4:  # April onwards
-            current_fy_start_year = current_year
-        else:  # January-March
-            current_fy_start_year = current_year - 1
-
-        # Calculate last and previous financial years
-        last_fy_start_year = current_fy_start_year - 1
-        previous_fy_start_year = current_fy_start_year - 2
-
-        # Calculate total COMPLETED months passed in current FY (excluding current month)
-        if current_month >= 4:
-            # Same calendar year as FY start
-            completed_months_in_current_fy = (
-                current_month - 4
-            )  # Don't add +1 since we exclude current month
-        else:
-            # Next calendar year (Jan-Mar)
-            completed_months_in_current_fy = (
-                12 - 4
-            ) + current_month  # (Apr-Dec) + (Jan-current month, excluding current)
-
-        # Ensure we have at least 1 month to avoid division by zero
-        completed_months_in_current_fy = max(1, completed_months_in_current_fy)
-
-        # Complete aggregation pipeline
-        pipeline = [
-            # Stage 1: Filter invoices from April 1, 2023 onwards and only paid invoices
-            {"$match": match_stage},
-            # Stage 2: Add computed fields for date analysis
-            {
-                "$addFields": {
-                    "invoiceDate": {"$dateFromString": {"dateString": "$date"}},
-                    "year": {"$year": {"$dateFromString": {"dateString": "$date"}}},
-                    "month": {"$month": {"$dateFromString": {"dateString": "$date"}}},
-                    "yearMonth": {
-                        "$concat": [
-                            {
-                                "$toString": {
-                                    "$year": {
-                                        "$dateFromString": {"dateString": "$date"}
-                                    }
-                                }
-                            },
-                            "-",
-                            {
-                                "$cond": {
-                                    "if": {
-                                        "$lt": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            10,
-                                        ]
-                                    },
-                                    "then": {
-                                        "$concat": [
-                                            "0",
-                                            {
-                                                "$toString": {
-                                                    "$month": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                }
-                                            },
-                                        ]
-                                    },
-                                    "else": {
-                                        "$toString": {
-                                            "$month": {
-                                                "$dateFromString": {
-                                                    "dateString": "$date"
-                                                }
-                                            }
-                                        }
-                                    },
-                                }
-                            },
-                        ]
-                    },
-                    # Add payment categorization logic
-                    "isDuePayment": {
-                        "$not": {
-                            "$in": ["$status", ["void", "draft", "sent", "paid"]]
-                        }
-                    },
-                    "isNotDuePayment": {
-                        "$not": {
-                            "$in": ["$status", ["void", "overdue", "partially_paid"]]
-                        }
-                    },
-                    # Check if invoice is in current month (dynamic)
-                    "isCurrentMonth": {
-                        "$and": [
-                            {
-                                "$eq": [
-                                    {
-                                        "$year": {
-                                            "$dateFromString": {"dateString": "$date"}
-                                        }
-                                    },
-                                    current_year,
-                                ]
-                            },
-                            {
-                                "$eq": [
-                                    {
-                                        "$month": {
-                                            "$dateFromString": {"dateString": "$date"}
-                                        }
-                                    },
-                                    current_month,
-                                ]
-                            },
-                        ]
-                    },
-                    # Check if invoice is in completed months (dynamic: current FY start to last month)
-                    "isCompletedMonth": {
-                        "$or": (
-                            [
-                                # Same FY year, from April to previous month
-                                {
-                                    "$and": [
-                                        {
-                                            "$eq": [
-                                                {
-                                                    "$year": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                current_fy_start_year,
-                                            ]
-                                        },
-                                        {
-                                            "$gte": [
-                                                {
-                                                    "$month": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                4,
-                                            ]
-                                        },
-                                        {
-                                            "$lt": [
-                                                {
-                                                    "$month": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                current_month,
-                                            ]
-                                        },
-                                    ]
-                                },
-                                # Next calendar year (if current month is Jan-Mar), from Jan to previous month
-                                {
-                                    "$and": [
-                                        {
-                                            "$eq": [
-                                                {
-                                                    "$year": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                current_fy_start_year + 1,
-                                            ]
-                                        },
-                                        {
-                                            "$gte": [
-                                                {
-                                                    "$month": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                1,
-                                            ]
-                                        },
-                                        {
-                                            "$lt": [
-                                                {
-                                                    "$month": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                current_month,
-                                            ]
-                                        },
-                                        {
-                                            "$lte": [
-                                                {
-                                                    "$month": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                3,
-                                            ]
-                                        },
-                                    ]
-                                },
-                            ]
-                            if current_month > 4
-                            else [
-                                # If current month is April or earlier, only check same calendar year
-                                {
-                                    "$and": [
-                                        {
-                                            "$eq": [
-                                                {
-                                                    "$year": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                current_fy_start_year,
-                                            ]
-                                        },
-                                        {
-                                            "$gte": [
-                                                {
-                                                    "$month": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                4,
-                                            ]
-                                        },
-                                        {
-                                            "$lt": [
-                                                {
-                                                    "$month": {
-                                                        "$dateFromString": {
-                                                            "dateString": "$date"
-                                                        }
-                                                    }
-                                                },
-                                                current_month,
-                                            ]
-                                        },
-                                    ]
-                                }
-                            ]
-                        )
-                    },
-                    # Check if invoice is in current financial year (dynamic)
-                    "isCurrentFY": {
-                        "$or": [
-                            # From April onwards in FY start year
-                            {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            current_fy_start_year,
-                                        ]
-                                    },
-                                    {
-                                        "$gte": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            4,
-                                        ]
-                                    },
-                                ]
-                            },
-                            # Jan-Mar in next calendar year (if FY spans two calendar years)
-                            {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            current_fy_start_year + 1,
-                                        ]
-                                    },
-                                    {
-                                        "$lte": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            3,
-                                        ]
-                                    },
-                                ]
-                            },
-                        ]
-                    },
-                    # Check if invoice is in last financial year (dynamic)
-                    "isLastFY": {
-                        "$or": [
-                            {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            last_fy_start_year,
-                                        ]
-                                    },
-                                    {
-                                        "$gte": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            4,
-                                        ]
-                                    },
-                                ]
-                            },
-                            {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            last_fy_start_year + 1,
-                                        ]
-                                    },
-                                    {
-                                        "$lte": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            3,
-                                        ]
-                                    },
-                                ]
-                            },
-                        ]
-                    },
-                    # Check if invoice is in previous financial year (dynamic)
-                    "isPreviousFY": {
-                        "$or": [
-                            {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            previous_fy_start_year,
-                                        ]
-                                    },
-                                    {
-                                        "$gte": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            4,
-                                        ]
-                                    },
-                                ]
-                            },
-                            {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            previous_fy_start_year + 1,
-                                        ]
-                                    },
-                                    {
-                                        "$lte": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            3,
-                                        ]
-                                    },
-                                ]
-                            },
-                        ]
-                    },
-                    # Normalize city name to handle variations (with null handling) - Updated to use shipping_address
-                    "normalizedCity": {
-                        "$switch": {
-                            "branches": [
-                                {
-                                    "case": {
-                                        "$and": [
-                                            {
-                                                "$ne": [
-                                                    "$shipping_address.city",
-                                                    None
-                                                ]
-                                            },
-                                            {
-                                                "$ne": [
-                                                    "$shipping_address.city",
-                                                    ""
-                                                ]
-                                            },
-                                            {
-                                                "$regexMatch": {
-                                                    "input": {
-                                                        "$ifNull": [
-                                                            "$shipping_address.city",
-                                                            ""
-                                                        ]
-                                                    },
-                                                    "regex":
-                                                        "^(bangalore|bengaluru)$",
-                                                    "options": "i"
-                                                }
-                                            }
-                                        ]
-                                    },
-                                    "then": "bengaluru"
-                                },
-                                {
-                                    "case": {
-                                        "$and": [
-                                            {
-                                                "$ne": [
-                                                    "$shipping_address.city",
-                                                    None
-                                                ]
-                                            },
-                                            {
-                                                "$ne": [
-                                                    "$shipping_address.city",
-                                                    ""
-                                                ]
-                                            },
-                                            {
-                                                "$regexMatch": {
-                                                    "input": {
-                                                        "$ifNull": [
-                                                            "$shipping_address.city",
-                                                            ""
-                                                        ]
-                                                    },
-                                                    "regex": "^(mumbai|bombay)$",
-                                                    "options": "i"
-                                                }
-                                            }
-                                        ]
-                                    },
-                                    "then": "mumbai"
-                                },
-                                {
-                                    "case": {
-                                        "$and": [
-                                            {
-                                                "$ne": [
-                                                    "$shipping_address.city",
-                                                    None
-                                                ]
-                                            },
-                                            {
-                                                "$ne": [
-                                                    "$shipping_address.city",
-                                                    ""
-                                                ]
-                                            },
-                                            {
-                                                "$regexMatch": {
-                                                    "input": {
-                                                        "$ifNull": [
-                                                            "$shipping_address.city",
-                                                            ""
-                                                        ]
-                                                    },
-                                                    "regex":
-                                                        "^(delhi|new delhi)$",
-                                                    "options": "i"
-                                                }
-                                            }
-                                        ]
-                                    },
-                                    "then": "delhi"
-                                }
-                            ],
-                            "default": {
-                                "$toLower": {
-                                    "$ifNull": [
-                                        "$shipping_address.city",
-                                        "unknown_city"
-                                    ]
-                                }
-                            }
-                        }
-                    },
-                    # Add fields to check for missing shipping address data
-                    "hasShippingAddress": {
-                        "$ne": ["$shipping_address", None]
-                    },
-                    "shippingAddressComplete": {
-                        "$and": [
-                            { "$ne": ["$shipping_address", None] },
-                            {
-                                "$ne": ["$shipping_address.city", None]
-                            },
-                            { "$ne": ["$shipping_address.city", ""] },
-                            {
-                                "$ne": ["$shipping_address.state", None]
-                            },
-                            {
-                                "$ne": [
-                                    "$shipping_address.country",
-                                    None
-                                ]
-                            }
-                        ]
-                    },
-                    # Billing period validations (dynamic)
-                    # Last month (previous month from current)
-                    "billedLastMonth": {
-                        "$and": [
-                            {
-                                "$eq": [
-                                    {
-                                        "$year": {
-                                            "$dateFromString": {"dateString": "$date"}
-                                        }
-                                    },
-                                    (
-                                        current_year
-                                        if current_month > 1
-                                        else current_year - 1
-                                    ),
-                                ]
-                            },
-                            {
-                                "$eq": [
-                                    {
-                                        "$month": {
-                                            "$dateFromString": {"dateString": "$date"}
-                                        }
-                                    },
-                                    current_month - 1 if current_month > 1 else 12,
-                                ]
-                            },
-                        ]
-                    },
-                    # Last 45 days (dynamic calculation)
-                    "billedLast45Days": {
-                        "$gte": [
-                            {"$dateFromString": {"dateString": "$date"}},
+
+# Values of the per-invoice `period` field. The buckets do not overlap, so one
+# int replaces a boolean field per window. The bucket is computed in the
+# pipeline rather than stored on the invoice: it is relative to the current
+# month, so a stored value would go stale every month, and it cannot narrow
+# the $match because older invoices are still needed (see ANALYTICS_START_DATE).
+PERIOD_CURRENT_MONTH = 0
+# Completed months of the current FY: April up to last month
+PERIOD_COMPLETED_MONTH = 1
+# Dated after this month but still inside the current FY
+PERIOD_LATER_IN_CURRENT_FY = 2
+PERIOD_LAST_FY = 3
+PERIOD_PREVIOUS_FY = 4
+
+_IS_CURRENT_MONTH = {"$eq": ["$period", PERIOD_CURRENT_MONTH]}
+_IS_CURRENT_FY = {
+    "$in": [
+        "$period",
+        [PERIOD_CURRENT_MONTH, PERIOD_COMPLETED_MONTH, PERIOD_LATER_IN_CURRENT_FY],
+    ]
+}
+_IS_LAST_FY = {"$eq": ["$period", PERIOD_LAST_FY]}
+_IS_PREVIOUS_FY = {"$eq": ["$period", PERIOD_PREVIOUS_FY]}
+
+
+_DateWindows = namedtuple(
+    "_DateWindows",
+    [
+        "last_month_start",
+        "last_2_months_start",
+        "last_3_months_start",
+        "completed_months_in_current_fy",
+        "current_month_start",
+        "next_month_start",
+        "current_fy_start",
+        "next_fy_start",
+        "last_fy_start",
+        "previous_fy_start",
+    ],
+)
+
+
+@lru_cache(maxsize=8)
+def _date_windows(current_year, current_month):
+    """Month and financial-year window bounds for a request made in
+    (current_year, current_month). Only the month matters, so this and the
+    stage built from it are computed once per month rather than per request.
+    """
+    last_month_start = _month_start(current_year, current_month, 1)
+    # "Last N months" means this month plus the N-1 before it
+    last_2_months_start = last_month_start
+    last_3_months_start = _month_start(current_year, current_month, 2)
+
+    # Calculate current financial year
+    if current_month >= 4:  # April onwards
+        current_fy_start_year = current_year
+    else:  # January-March
+        current_fy_start_year = current_year - 1
+
+    # Calculate last and previous financial years
+    last_fy_start_year = current_fy_start_year - 1
+    previous_fy_start_year = current_fy_start_year - 2
+
+    # Calculate total COMPLETED months passed in current FY (excluding current month)
+    if current_month >= 4:
+        # Same calendar year as FY start
+        completed_months_in_current_fy = (
+            current_month - 4
+        )  # Don't add +1 since we exclude current month
+    else:
+        # Next calendar year (Jan-Mar)
+        completed_months_in_current_fy = (
+            12 - 4
+        ) + current_month  # (Apr-Dec) + (Jan-current month, excluding current)
+
+    # Ensure we have at least 1 month to avoid division by zero
+    completed_months_in_current_fy = max(1, completed_months_in_current_fy)
+
+    # Window bounds as ISO date strings, comparable with the invoice `date` field
+    current_month_start = _month_start(current_year, current_month)
+    next_month_start = _month_start(current_year, current_month, -1)
+    next_fy_start = f"{current_fy_start_year + 1}-04-01"
+    current_fy_start = f"{current_fy_start_year}-04-01"
+    last_fy_start = f"{last_fy_start_year}-04-01"
+    previous_fy_start = f"{previous_fy_start_year}-04-01"
+
+    return _DateWindows(
+        last_month_start,
+        last_2_months_start,
+        last_3_months_start,
+        completed_months_in_current_fy,
+        current_month_start,
+        next_month_start,
+        current_fy_start,
+        next_fy_start,
+        last_fy_start,
+        previous_fy_start,
+    )
+
+
+@lru_cache(maxsize=8)
+def _date_fields_stage(windows):
+    """Stage 2 of the pipeline: per-invoice period bucket and normalized city,
+    encoded once per month."""
+    return _encoded(
+        {
+            "$addFields": {
+                # Month / financial-year bucket as one small int (see PERIOD_*).
+                # `date` is stored as an ISO "YYYY-MM-DD" string, so comparing it
+                # to the window bounds directly orders the same way the parsed
+                # date would; checking the bounds newest first means each invoice
+                # stops at the first one it clears.
+                "period": {
+                    "$switch": {
+                        "branches": [
                             {
-                                "$dateFromString": {
-                                    "dateString": f"{current_date.year}-{current_date.month:02d}-{max(1, current_date.day - 45):02d}"
-                                }
+                                "case": {"$gte": ["$date", windows.next_fy_start]},
+                                "then": None,
                             },
-                        ]
-                    },
-                    # Last 2 months (dynamic)
-                    "billedLast2Months": {
-                        "$or": [
-                            # Current month
                             {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            current_year,
-                                        ]
-                                    },
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            current_month,
-                                        ]
-                                    },
-                                ]
+                                "case": {"$gte": ["$date", windows.next_month_start]},
+                                "then": PERIOD_LATER_IN_CURRENT_FY,
                             },
-                            # Previous month
                             {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            (
-                                                current_year
-                                                if current_month > 1
-                                                else current_year - 1
-                                            ),
-                                        ]
-                                    },
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            (
-                                                current_month - 1
-                                                if current_month > 1
-                                                else 12
-                                            ),
-                                        ]
-                                    },
-                                ]
+                                "case": {"$gte": ["$date", windows.current_month_start]},
+                                "then": PERIOD_CURRENT_MONTH,
                             },
-                        ]
-                    },
-                    # Last 3 months (dynamic)
-                    "billedLast3Months": {
-                        "$or": [
-                            # Current month
                             {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            current_year,
-                                        ]
-                                    },
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            current_month,
-                                        ]
-                                    },
-                                ]
+                                "case": {"$gte": ["$date", windows.current_fy_start]},
+                                "then": PERIOD_COMPLETED_MONTH,
                             },
-                            # Previous month
                             {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            (
-                                                current_year
-                                                if current_month > 1
-                                                else current_year - 1
-                                            ),
-                                        ]
-                                    },
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            (
-                                                current_month - 1
-                                                if current_month > 1
-                                                else 12
-                                            ),
-                                        ]
-                                    },
-                                ]
+                                "case": {"$gte": ["$date", windows.last_fy_start]},
+                                "then": PERIOD_LAST_FY,
                             },
-                            # Month before that
                             {
-                                "$and": [
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$year": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            (
-                                                current_year
-                                                if current_month > 2
-                                                else current_year - 1
-                                            ),
-                                        ]
-                                    },
-                                    {
-                                        "$eq": [
-                                            {
-                                                "$month": {
-                                                    "$dateFromString": {
-                                                        "dateString": "$date"
-                                                    }
-                                                }
-                                            },
-                                            (
-                                                current_month - 2
-                                                if current_month > 2
-                                                else (12 + current_month - 2)
-                                            ),
-                                        ]
-                                    },
-                                ]
+                                "case": {"$gte": ["$date", windows.previous_fy_start]},
+                                "then": PERIOD_PREVIOUS_FY,
                             },
-                        ]
-                    },
-                }
-            },
-            # Stage 3: Group by customer and normalized address components (updated to use shipping address)
-            {
-                "$group": {
-                    "_id": {
-                        "customerId": "$customer_id",
-                        "city": "$normalizedCity",
-                        "state": "$shipping_address.state",
-                        "zip": "$shipping_address.zip",
-                        "country": "$shipping_address.country",
-                    },
-                    "customerName": {"$first": "$customer_name"},
-                    "shippingAddress": {"$first": "$shipping_address"},
-                    # Updated logic: Get the salesperson field that matches the sp_code
-                    "salesPerson": {"$first": sales_person_logic},
-                    
-                    # NEW: Collect ALL invoices for validation
-                    "allInvoices": {
-                        "$push": {
-                            "_id": "$_id",
-                            "invoice_number": "$invoice_number",
-                            "date": "$date",
-                            "due_date": "$due_date",
-                            "status": "$status",
-                            "total": "$total",
-                            "balance": "$balance",
-                            "customer_id": "$customer_id",
-                            "invoice_id": "$invoice_id",
-                            "yearMonth": "$yearMonth",
-                            "isCurrentMonth": "$isCurrentMonth",
-                            "isCurrentFY": "$isCurrentFY",
-                            "isLastFY": "$isLastFY",
-                            "isPreviousFY": "$isPreviousFY"
-                        }
-                    },
-                    
-                    # Collect payment information
-                    "duePayments": {
-                        "$push": {
-                            "$cond": [
-                                "$isDuePayment",
-                                {
-                                    "_id": "$_id",
-                                    "date": "$date",
-                                    "due_date": "$due_date",
-                                    "invoice_number": "$invoice_number",
-                                    "status": "$status",
-                                    "invoice_id": "$invoice_id",
-                                    "total": "$total",
-                                    "balance": "$balance",
-                                },
-                                "$$REMOVE"
-                            ]
-                        }
-                    },
-                    "notDuePayments": {
-                        "$push": {
-                            "$cond": [
-                                "$isNotDuePayment",
-                                {
-                                    "_id": "$_id",
-                                    "date": "$date",
-                                    "due_date": "$due_date",
-                                    "invoice_number": "$invoice_number",
-                                    "status": "$status",
-                                    "invoice_id": "$invoice_id",
-                                    "balance": "$balance",
-                                    "total": "$total",
-                                },
-                                "$$REMOVE"
-                            ]
-                        }
-                    },
-                    # Total sales current month (August 2025)
-                    "totalSalesCurrentMonth": {
-                        "$sum": {
-                            "$cond": [{"$eq": ["$isCurrentMonth", True]}, "$total", 0]
-                        }
-                    },
-                    # Last bill date
-                    "lastBillDate": {"$max": "$invoiceDate"},
-                    # FIXED: Count of ALL orders in current financial year for frequency calculation
-                    "currentFYOrders": {
-                        "$sum": {"$cond": [{"$eq": ["$isCurrentFY", True]}, 1, 0]}
-                    },
-                    # FIXED: Unique months in current financial year for frequency calculation
-                    "currentFYMonths": {
-                        "$addToSet": {
-                            "$cond": [
-                                {"$eq": ["$isCurrentFY", True]},
-                                "$yearMonth",
-                                None,
-                            ]
-                        }
-                    },
-                    # Keep completed month orders for backward compatibility (if needed elsewhere)
-                    "completedMonthOrders": {
-                        "$sum": {"$cond": [{"$eq": ["$isCompletedMonth", True]}, 1, 0]}
-                    },
-                    # Keep completed months for backward compatibility (if needed elsewhere)
-                    "completedMonths": {
-                        "$addToSet": {
+                        ],
+                        "default": None,
+                    }
+                },
+                "normalizedCity": _NORMALIZED_CITY,
+            }
+        }
+    )
+
+
+@lru_cache(maxsize=64)
+def _pipeline_stages(windows, last_45_days_start, due_status, last_billed, sp_code):
+    """Every stage after the $match, encoded.
+
+    None of them depend on the customer ids, only on the day and the filters,
+    so each combination is built and encoded once a day instead of on every
+    request. Returned as a tuple, which pymongo reads but never mutates.
+    """
+    # Create the salesPerson field logic based on whether sp_code is provided
+    if sp_code:
+        # If sp_code is provided, return the field that matches the sp_code
+        sales_person_logic = {
+            "$cond": [
+                {"$eq": ["$salesperson_name", sp_code]},
+                "$salesperson_name",
+                {
+                    "$cond": [
+                        {"$eq": ["$cf_sales_person", sp_code]},
+                        "$cf_sales_person",
+                        # Fallback to first non-null if neither matches (shouldn't happen due to filter)
+                        {
                             "$cond": [
-                                {"$eq": ["$isCompletedMonth", True]},
-                                "$yearMonth",
-                                None,
+                                {"$ne": ["$salesperson_name", None]},
+                                "$salesperson_name",
+                                "$cf_sales_person",
                             ]
-                        }
-                    },
-                    # Total billing current year (April 2025 onwards)
-                    "billingTillDateCurrentYear": {
-                        "$sum": {
-                            "$cond": [{"$eq": ["$isCurrentFY", True]}, "$total", 0]
-                        }
-                    },
-                    # Total sales last financial year (April 2024 - March 2025)
-                    "totalSalesLastFY": {
-                        "$sum": {"$cond": [{"$eq": ["$isLastFY", True]}, "$total", 0]}
-                    },
-                    # Total sales previous financial year (April 2023 - March 2024)
-                    "totalSalesPreviousFY": {
-                        "$sum": {
-                            "$cond": [{"$eq": ["$isPreviousFY", True]}, "$total", 0]
-                        }
-                    },
-                    # Billing validation checks
-                    "hasBilledLastMonth": {
-                        "$sum": {"$cond": [{"$eq": ["$billedLastMonth", True]}, 1, 0]}
-                    },
-                    "hasBilledLast45Days": {
-                        "$sum": {"$cond": [{"$eq": ["$billedLast45Days", True]}, 1, 0]}
-                    },
-                    "hasBilledLast2Months": {
-                        "$sum": {"$cond": [{"$eq": ["$billedLast2Months", True]}, 1, 0]}
-                    },
-                    "hasBilledLast3Months": {
-                        "$sum": {"$cond": [{"$eq": ["$billedLast3Months", True]}, 1, 0]}
-                    },
-                    # All invoice dates for additional analysis
-                    "allInvoiceDates": {"$push": "$invoiceDate"},
-                }
-            },
-            # Stage 4: Lookup customer details from customers collection
-            {
-                "$lookup": {
-                    "from": "customers",
-                    "localField": "_id.customerId",
-                    "foreignField": "contact_id",
-                    "as": "customerDetails",
-                }
-            },
-            {"$match": customer_status_match_stage},
-            # Stage 5: Calculate average order frequency and billing validations
-            {
-                "$addFields": {
-                    # FIXED: Remove null values from currentFYMonths array (for frequency calculation)
-                    "currentFYMonthsFiltered": {
-                        "$filter": {
-                            "input": "$currentFYMonths",
-                            "cond": {"$ne": ["$$this", None]},
-                        }
-                    },
-                    # Keep the old logic for backward compatibility
-                    "completedMonthsFiltered": {
-                        "$filter": {
-                            "input": "$completedMonths",
-                            "cond": {"$ne": ["$$this", None]},
-                        }
-                    },
-                    # Extract customer status and tier from lookup
-                    "customerStatus": {
-                        "$ifNull": [
-                            {"$arrayElemAt": ["$customerDetails.status", 0]},
-                            "unknown",
-                        ]
-                    },
-                    "customerTier": {
-                        "$ifNull": [
-                            {"$arrayElemAt": ["$customerDetails.cf_tier", 0]},
-                            "unknown",
-                        ]
-                    },
-                    # Boolean flags for billing periods (true = HAS billed)
-                    "hasBilledLastMonth": {"$gt": ["$hasBilledLastMonth", 0]},
-                    "hasBilledLast45Days": {"$gt": ["$hasBilledLast45Days", 0]},
-                    "hasBilledLast2Months": {"$gt": ["$hasBilledLast2Months", 0]},
-                    "hasBilledLast3Months": {"$gt": ["$hasBilledLast3Months", 0]},
-                }
-            },
-            # Stage 6: Calculate final metrics
-            {
-                "$addFields": {
-                    # FIXED: Calculate frequency using total orders divided by completed months in FY
-                    "averageOrderFrequencyMonthly": {
-                        "$cond": [
-                            {"$gt": ["$currentFYOrders", 0]},
-                            {
-                                "$divide": [
-                                    "$currentFYOrders",
-                                    completed_months_in_current_fy,
-                                ]
-                            },
-                            0,
-                        ]
-                    },
-                    # Format shipping address as string (updated from billing to shipping)
-                    "shippingAddressFormatted": {
-                        "$concat": [
-                            {"$ifNull": ["$shippingAddress.street", ""]},
-                            {
-                                "$cond": [
-                                    {"$ne": ["$shippingAddress.street2", ""]},
-                                    {"$concat": [", ", "$shippingAddress.street2"]},
-                                    "",
-                                ]
-                            },
-                            {
-                                "$cond": [
-                                    {"$ne": ["$shippingAddress.city", ""]},
-                                    {"$concat": [", ", "$shippingAddress.city"]},
-                                    "",
-                                ]
-                            },
-                            {
-                                "$cond": [
-                                    {"$ne": ["$shippingAddress.state", ""]},
-                                    {"$concat": [", ", "$shippingAddress.state"]},
-                                    "",
-                                ]
-                            },
-                            {
-                                "$cond": [
-                                    {"$ne": ["$shippingAddress.zip", ""]},
-                                    {"$concat": [" - ", "$shippingAddress.zip"]},
-                                    "",
-                                ]
-                            },
-                        ]
-                    },
-                }
-            },
-            # Stage 7: Filter based on due_status if not "all"
-            {
-                "$addFields": {
-                    # Apply filtering based on due_status parameter
-                    "filteredDuePayments": {
-                        "$cond": [
-                            {"$or": [
-                                {"$eq": [due_status, "all"]},
-                                {"$eq": [due_status, "due"]}
-                            ]},
-                            "$duePayments",
-                            []
-                        ]
-                    },
-                    "filteredNotDuePayments": {
-                        "$cond": [
-                            {"$or": [
-                                {"$eq": [due_status, "all"]},
-                                {"$eq": [due_status, "not_due"]}
-                            ]},
-                            "$notDuePayments",
-                            []
-                        ]
+                        },
+                    ]
+                },
+            ]
+        }
+    else:
+        # If no sp_code filter, use the original logic
+        sales_person_logic = {
+            "$cond": [
+                {"$ne": ["$salesperson_name", None]},
+                "$salesperson_name",
+                "$cf_sales_person",
+            ]
+        }
+
+    stages = [
+        # Carry only the invoice fields later stages read
+        _INVOICE_FIELDS_STAGE,
+        # Stage 2: Add computed fields for date analysis
+        _date_fields_stage(windows),
+        # Stage 3: Group by customer and normalized address components (updated to use shipping address)
+        {
+            "$group": {
+                "_id": {
+                    "customerId": "$customer_id",
+                    "city": "$normalizedCity",
+                    "state": "$shipping_address.state",
+                    "zip": "$shipping_address.zip",
+                    "country": "$shipping_address.country",
+                },
+                "customerName": {"$first": "$customer_name"},
+                # Only the parts the formatted address is built from (see
+                # _format_address); the rest of the Zoho address (attention,
+                # phone, fax, ...) is never returned.
+                "shippingAddress": {
+                    "$first": {
+                        "street": "$shipping_address.street",
+                        "street2": "$shipping_address.street2",
+                        "city": "$shipping_address.city",
+                        "state": "$shipping_address.state",
+                        "zip": "$shipping_address.zip",
                     }
-                }
-            },
-            {
-                "$match": {
-                    "$expr": {
-                        "$or": [
-                            {
-                                "$eq": [due_status, "all"]
-                            },  # Include all customers when due_status is "all"
-                            {
-                                "$and": [
-                                    {"$eq": [due_status, "due"]},
-                                    {
-                                        "$gt": [{"$size": "$filteredDuePayments"}, 0]
-                                    },  # Only customers with due payments
-                                ]
-                            },
-                            {
-                                "$and": [
-                                    {"$eq": [due_status, "not_due"]},
-                                    {
-                                        "$gt": [{"$size": "$filteredNotDuePayments"}, 0]
-                                    },  # Only customers with not due payments
-                                ]
-                            },
-                        ]
+                },
+                # Updated logic: Get the salesperson field that matches the sp_code
+                "salesPerson": {"$first": sales_person_logic},
+                
+                # NEW: Collect ALL invoices for validation
+                "allInvoices": {
+                    "$push": {
+                        # As a string, so the encoder never has to call back
+                        # into Python for an ObjectId
+                        "_id": {"$toString": "$_id"},
+                        "invoice_number": "$invoice_number",
+                        "date": "$date",
+                        "due_date": "$due_date",
+                        "status": "$status",
+                        "total": "$total",
+                        "balance": "$balance",
+                        "customer_id": "$customer_id",
+                        "invoice_id": "$invoice_id",
+                        # "YYYY-MM" is the prefix of the stored "YYYY-MM-DD"
+                        # date, so no date parsing is needed for the month key
+                        "yearMonth": {"$substrCP": ["$date", 0, 7]},
+                        "isCurrentMonth": _IS_CURRENT_MONTH,
+                        "isCurrentFY": _IS_CURRENT_FY,
+                        "isLastFY": _IS_LAST_FY,
+                        "isPreviousFY": _IS_PREVIOUS_FY,
                     }
-                }
-            },
-            # NEW Stage 8: Filter based on last_billed parameter
-            {
-                "$match": {
-                    "$expr": {
-                        "$or": [
-                            {"$eq": [last_billed, "all"]},  # Include all customers
-                            # Positive filters (customers who HAVE billed in specific periods)
-                            {
-                                "$and": [
-                                    {"$eq": [last_billed, "last_month"]},
-                                    {"$eq": ["$hasBilledLastMonth", True]},
-                                ]
-                            },
-                            {
-                                "$and": [
-                                    {"$eq": [last_billed, "last_45_days"]},
-                                    {"$eq": ["$hasBilledLast45Days", True]},
-                                ]
-                            },
-                            {
-                                "$and": [
-                                    {"$eq": [last_billed, "last_2_months"]},
-                                    {"$eq": ["$hasBilledLast2Months", True]},
-                                ]
-                            },
-                            {
-                                "$and": [
-                                    {"$eq": [last_billed, "last_3_months"]},
-                                    {"$eq": ["$hasBilledLast3Months", True]},
-                                ]
-                            },
-                            # Negative filters (customers who have NOT billed in specific periods)
-                            {
-                                "$and": [
-                                    {"$eq": [last_billed, "not_last_month"]},
-                                    {"$eq": ["$hasBilledLastMonth", False]},
-                                ]
-                            },
-                            {
-                                "$and": [
-                                    {"$eq": [last_billed, "not_last_45_days"]},
-                                    {"$eq": ["$hasBilledLast45Days", False]},
-                                ]
-                            },
-                            {
-                                "$and": [
-                                    {"$eq": [last_billed, "not_last_2_months"]},
-                                    {"$eq": ["$hasBilledLast2Months", False]},
-                                ]
-                            },
-                            {
-                                "$and": [
-                                    {"$eq": [last_billed, "not_last_3_months"]},
-                                    {"$eq": ["$hasBilledLast3Months", False]},
-                                ]
-                            },
-                        ]
+                },
+                
+                # Total sales current month (August 2025)
+                "totalSalesCurrentMonth": {
+                    "$sum": {
+                        "$cond": [_IS_CURRENT_MONTH, "$total", 0]
                     }
-                }
-            },
-            # Stage 9: Project final output format
-            {
-                "$project": {
-                    "_id": 0,
-                    "customerName": 1,
-                    "shippingAddress": "$shippingAddressFormatted",  # Updated to use shipping address
-                    "status": "$customerStatus",
-                    "tier": "$customerTier",
-                    "totalSalesCurrentMonth": {
-                        "$round": ["$totalSalesCurrentMonth", 2]
-                    },
-                    "lastBillDate": {
-                        "$dateToString": {"format": "%Y-%m-%d", "date": "$lastBillDate"}
-                    },
-                    "averageOrderFrequencyMonthly": {
-                        "$round": ["$averageOrderFrequencyMonthly", 2]
-                    },
-                    "billingTillDateCurrentYear": {
-                        "$round": ["$billingTillDateCurrentYear", 2]
-                    },
-                    "totalSalesLastFY": {"$round": ["$totalSalesLastFY", 2]},
-                    "totalSalesPreviousFY": {"$round": ["$totalSalesPreviousFY", 2]},
-                    "salesPerson": 1,
-                    "hasBilledLastMonth": 1,
-                    "hasBilledLast45Days": 1,
-                    "hasBilledLast2Months": 1,
-                    "hasBilledLast3Months": 1,
-                    # Include payment lists
-                    "duePayments": "$filteredDuePayments",
-                    "notDuePayments": "$filteredNotDuePayments",
-                    
-                    # NEW: Include all invoices for validation
-                    "allInvoices": 1,
-                    
-                    # Additional fields for validation
-                    "totalInvoiceCount": {
-                        "$size": "$allInvoices"
-                    },
-                    "currentFYInvoiceCount": "$currentFYOrders"
-                }
-            },
-            # Stage 10: Sort by customer name
-            {"$sort": {"customerName": 1}},
+                },
+                # Last bill date, kept as the "YYYY-MM-DD" string it is stored
+                # as; ISO strings order like the dates they spell
+                "lastBillDate": {"$max": "$date"},
+                # FIXED: Count of ALL orders in current financial year for frequency calculation
+                "currentFYOrders": {
+                    "$sum": {"$cond": [_IS_CURRENT_FY, 1, 0]}
+                },
+                # Total billing current year (April 2025 onwards)
+                "billingTillDateCurrentYear": {
+                    "$sum": {
+                        "$cond": [_IS_CURRENT_FY, "$total", 0]
+                    }
+                },
+                # Total sales last financial year (April 2024 - March 2025)
+                "totalSalesLastFY": {
+                    "$sum": {"$cond": [_IS_LAST_FY, "$total", 0]}
+                },
+                # Total sales previous financial year (April 2023 - March 2024)
+                "totalSalesPreviousFY": {
+                    "$sum": {
+                        "$cond": [_IS_PREVIOUS_FY, "$total", 0]
+                    }
+                },
+                # Billing validation checks: an existence test, so $max of
+                # the per-invoice boolean rather than a count
+                "hasBilledLastMonth": {
+                    "$max": _in_range(
+                        "$date",
+                        windows.last_month_start,
+                        windows.current_month_start,
+                    )
+                },
+            }
+        },
+        # Filter on last_billed and due_status as soon as the grouped fields
+        # they read exist, so customers they drop skip the lookup and
+        # everything after
+        *_last_billed_stages(last_billed, windows, last_45_days_start),
+        # Due / not-due payment lists, and the due_status filter
+        *_due_status_stages(due_status),
+        # Stage 4: Lookup customer details from customers collection
+        _CUSTOMER_DETAILS_LOOKUP,
+        # Stage 5: Customer status and tier from the lookup
+        {
+            "$addFields": {
+                # Extract customer status and tier from lookup
+                "customerStatus": {
+                    "$ifNull": [
+                        {"$arrayElemAt": ["$customerDetails.status", 0]},
+                        "unknown",
+                    ]
+                },
+                "customerTier": {
+                    "$ifNull": [
+                        {"$arrayElemAt": ["$customerDetails.cf_tier", 0]},
+                        "unknown",
+                    ]
+                },
+            }
+        },
+        # Stage 6: Calculate final metrics
+        {
+            "$addFields": {
+                # Boolean flags for billing periods (true = HAS billed)
+                # The rolling windows all run up to today, so whether a
+                # customer billed inside one only depends on their latest
+                # invoice — no need to test every invoice against each window.
+                "hasBilledLast45Days": {
+                    "$gte": ["$lastBillDate", last_45_days_start]
+                },
+                "hasBilledLast2Months": {
+                    "$gte": ["$lastBillDate", windows.last_2_months_start]
+                },
+                "hasBilledLast3Months": {
+                    "$gte": ["$lastBillDate", windows.last_3_months_start]
+                },
+                # FIXED: Calculate frequency using total orders divided by completed months in FY
+                "averageOrderFrequencyMonthly": {
+                    "$cond": [
+                        {"$gt": ["$currentFYOrders", 0]},
+                        {
+                            "$divide": [
+                                "$currentFYOrders",
+                                windows.completed_months_in_current_fy,
+                            ]
+                        },
+                        0,
+                    ]
+                },
+            }
+        },
+        # Stages 7-8: output shape and order
+        *_OUTPUT_STAGES,
+    ]
+    return tuple(
+        stage if isinstance(stage, RawBSONDocument) else _encoded(stage)
+        for stage in stages
+    )
+
+
+def _build_pipeline(customer_ids, due_status, last_billed, sp_code):
+    """Assemble the invoice aggregation for one salesperson (or all of them).
+
+    customer_ids, when not None, limits it to those customers' invoices (see
+    _matching_customer_ids).
+    """
+    # Build the match stage dynamically
+    match_stage = {
+        "date": {"$gte": ANALYTICS_START_DATE},
+        "status": {"$nin": ["void", "draft"]},
+        "customer_name": {
+            "$regex": EXCLUDED_CUSTOMER_NAME_PATTERN,
+            "$options": "is",
+        },
+    }
+
+    # Customer status / tier filters, resolved to customer ids up front
+    if customer_ids is not None:
+        match_stage["customer_id"] = {"$in": customer_ids}
+
+    # Add salesperson filter if provided
+    if sp_code:
+        match_stage["$or"] = [
+            {"salesperson_name": sp_code},
+            {"cf_sales_person": sp_code},
         ]
 
-        customers = list(db.invoices.aggregate(pipeline))
-        return serialize_mongo_document(customers)
+    # Get current date for dynamic calculations
+    current_date = datetime.now()
+    windows = _date_windows(current_date.year, current_date.month)
+    # Day-based, so not part of the monthly windows. Counted in UTC days, as
+    # the $dateDiff against $$NOW it replaces did.
+    last_45_days_start = (
+        datetime.now(timezone.utc).date() - timedelta(days=45)
+    ).isoformat()
+
+    return [
+        # Stage 1: Filter invoices from April 1, 2023 onwards and only paid invoices
+        {"$match": match_stage},
+        *_pipeline_stages(
+            windows, last_45_days_start, due_status, last_billed, sp_code
+        ),
+    ]
+
+
+@router.get("")
+async def get_customer_analytics(
+    status: Optional[str] = Query(None, description="Filter by invoice status"),
+    tier: Optional[str] = Query(None, description="Filter by tiers (A,B,C)"),
+    due_status: Optional[str] = Query("all", description="Filter by Payments Due (all, due, not_due)"),
+    last_billed: Optional[str] = Query(
+        "all", description="Filter by last billing activity (all, last_month, last_45_days, last_2_months, last_3_months, not_last_month, not_last_45_days, not_last_2_months, not_last_3_months)"
+    ),
+    sp_code: Optional[str] = Query(None, description="Filter by salesperson code"),
+    sort_by: Optional[bool] = Query(True, description="Low to High or High to Low"),
+    format: Optional[str] = Query(
+        "json", description="Response format (json, ndjson)"
+    ),
+):
+    try:
+        if format == "ndjson":
+            encode, media_type = _stream_ndjson, "application/x-ndjson"
+        else:
+            encode, media_type = _stream_json_array, "application/json"
+
+        # sort_by is accepted for older clients but never changed the order:
+        # rows always come back sorted by customer name. It is left out of the
+        # key so it does not split the cache.
+        cache_key = (status, tier, due_status, last_billed, sp_code, media_type)
+        cached = _cached_response(cache_key)
+        if cached is not None:
+            return Response(content=cached, media_type=media_type)
+
+        # Read before any query runs: an invalidation that lands while the
+        # body is being built must leave it stale
+        generation = _current_generation()
+
+        customer_filter = _customer_filter(status, tier)
+        customer_ids = None
+        if customer_filter:
+            customer_ids = await asyncio.to_thread(
+                _matching_customer_ids, customer_filter
+            )
+
+        pipeline = _build_pipeline(customer_ids, due_status, last_billed, sp_code)
+
+        # aggregate() runs the first batch eagerly, so pipeline errors still
+        # surface here as a 500 rather than as a truncated stream. It blocks,
+        # so it runs off the event loop; cache hits above never leave it.
+        cursor = await asyncio.to_thread(_aggregate, pipeline)
+        return StreamingResponse(
+            _cache_stream(cache_key, generation, encode(cursor)),
+            media_type=media_type,
+        )
+    except (ExecutionTimeout, OperationFailure) as e:
+        # Timeouts and memory-limit failures come from load, not from the
+        # request; answer with the last body we built for the same filters
+        # if there is one.
+        if isinstance(e, ExecutionTimeout) or e.code in _MEMORY_LIMIT_ERROR_CODES:
+            stale = _stale_response(cache_key)
+            if stale is not None:
+                body, built_at = stale
+                logger.warning(
+                    "Serving stale customer analytics after aggregation failure: %s",
+                    e,
+                )
+                # Tell the client the figures are not live, and as of when
+                return Response(
+                    content=body,
+                    media_type=media_type,
+                    headers={
+                        "X-Analytics-Stale": datetime.fromtimestamp(
+                            built_at, timezone.utc
+                        ).isoformat(timespec="seconds")
+                    },
+                )
+            logger.error("Customer analytics aggregation failed: %s", e)
+            return JSONResponse(
+                status_code=503,
+                content={"error": "Customer analytics is busy, please retry"},
+            )
+        logger.error("Error in get_customer_analytics: %s", e)
+        return JSONResponse(status_code=500, content={"error": str(e)})
     except Exception as e:
-        logger.error(f"Error in get_customer_analytics: {str(e)}")
+        logger.error("Error in get_customer_analytics: %s", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
\ No newline at end of file
@@ -1,8 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Form, Response
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    HTTPException,
+    Depends,
+    File,
+    UploadFile,
+    Form,
+    Request,
+    Response,
+)
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from bson import ObjectId
+from pymongo import WriteConcern
 from ..config.root import get_database, serialize_mongo_document
 from ..config.auth import get_current_user
 from ..config.whatsapp import send_whatsapp
@@ -12,21 +23,72 @@ from .notifications import (
     ADMIN_NOTIFICATION_EMAILS,
 )
 from .admin_users import hash_password, generate_password
+from .admin_templates import get_template_by_name
+from .helpers import get_access_token
 from .users import make_login_link_token
 from ..config.phone import normalize_indian_mobile
 from ..config.email import send_email, esc, SITE_URL
 import os
+import asyncio
+import base64
+import hashlib
 import requests
 import logging
+import orjson
 import datetime as dt
 import boto3
 import time
 import re
+import random
+import threading
 from gstin_validator.core import validate_gstin as _validate_gstin_checksum
 
-router = APIRouter()
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError
+
+
+class MongoJSONResponse(Response):
+    """JSON rendered with orjson. ObjectIds come out as strings and datetimes as
+    ISO strings, the same as serialize_mongo_document makes them, so documents
+    can be returned as read from MongoDB."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_json_default)
+
+
+router = APIRouter(default_response_class=MongoJSONResponse)
 logger = logging.getLogger(__name__)
 
+_requests_collection = get_database().customer_creation_requests
+
+# Comment-thread edits only need the primary's acknowledgement: losing one to
+# a failover is recoverable by re-posting, unlike request or Zoho state, which
+# keeps the client's default write concern.
+_comment_writes = _requests_collection.with_options(
+    write_concern=WriteConcern(w=1, j=False)
+)
+
+# The request list filters on created_by (sales people see only their own)
+# and/or status, newest first with _id breaking ties. One index per filter
+# shape, each ending in the full sort key, so pages and cursors are index scans.
+try:
+    for _prefix in (
+        [],
+        [("created_by", 1)],
+        [("status", 1)],
+        [("created_by", 1), ("status", 1)],
+    ):
+        _requests_collection.create_index(
+            [*_prefix, ("created_at", -1), ("_id", -1)]
+        )
+except Exception:
+    pass
+
 # S3 configuration
 S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY")
 S3_SECRET_KEY = os.getenv("S3_SECRET_KEY")
@@ -37,6 +99,10 @@ _GSTIN_PATTERN = re.compile(r"^(\d{2})([A-Z]{5}\d{4}[A-Z])(\d)([A-Z])([0-9A-Z])$
 
 ALLOWED_DOC_TYPES = {"gst_certificate", "pan_card", "aadhar"}
 
+# Statuses an admin can set by hand. admin_commented and salesperson_replied are
+# set automatically by the comment/reply endpoints, created_on_zoho by approval.
+ALLOWED_MANUAL_STATUSES = ("pending", "approved", "rejected")
+
 # UTILITY WhatsApp template used to send customers their login instructions.
 CUSTOMER_LOGIN_TEMPLATE_NAME = os.getenv(
     "CUSTOMER_LOGIN_TEMPLATE_NAME", "customer_account_ready"
@@ -115,6 +181,119 @@ BOOKS_REFRESH_TOKEN = os.getenv("BOOKS_REFRESH_TOKEN")
 ORG_ID = os.getenv("ORG_ID")
 BOOKS_URL = os.getenv("BOOKS_URL")
 
+# Payment terms label (as picked on the form) -> Zoho payment_terms days
+ZOHO_PAYMENT_TERMS_DAYS = {
+    "Due On Receipt": 0,
+    "Upfront": 0,
+    "Immediate": 0,
+    "Net 15": 15,
+    "Net 30": 30,
+    "Net 45": 45,
+    "Net 60": 60,
+}
+
+# GST treatment label -> Zoho gst_treatment value
+ZOHO_GST_TREATMENTS = {
+    "Business GST": "business_gst",
+    "Unregistered Business": "business_none",
+    "Consumer": "consumer",
+    "Overseas": "overseas",
+}
+
+# Request fields copied into the Zoho contact notes, in order
+ZOHO_NOTE_FIELDS = (
+    ("margin_details", "Margin Details"),
+    ("sales_person", "Sales Person"),
+)
+
+# One pooled session for the Zoho Books calls, so approvals reuse a
+# kept-alive TLS connection instead of handshaking on every request
+_zoho_session = requests.Session()
+_zoho_session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=20)
+)
+
+# Transient Zoho failures are retried with exponential backoff and jitter.
+# After repeated failures the breaker short-circuits calls for a cooldown so
+# a Zoho outage doesn't leave admin requests queued on the threadpool.
+_ZOHO_MAX_ATTEMPTS = 3
+_ZOHO_BACKOFF_SECONDS = 0.5
+_ZOHO_MAX_BACKOFF_SECONDS = 4
+_ZOHO_RETRY_STATUSES = frozenset({429, 502, 503, 504})
+_ZOHO_BREAKER_THRESHOLD = 5
+_ZOHO_BREAKER_COOLDOWN_SECONDS = 30
+_zoho_breaker = {"failures": 0, "open_until": 0.0}
+_zoho_breaker_lock = threading.Lock()
+
+
+def _record_zoho_outcome(failed: bool):
+    with _zoho_breaker_lock:
+        if not failed:
+            _zoho_breaker["failures"] = 0
+            return
+        _zoho_breaker["failures"] += 1
+        if _zoho_breaker["failures"] >= _ZOHO_BREAKER_THRESHOLD:
+            _zoho_breaker["open_until"] = (
+                time.monotonic() + _ZOHO_BREAKER_COOLDOWN_SECONDS
+            )
+            _zoho_breaker["failures"] = 0
+            logger.error(
+                f"Zoho Books failing repeatedly; pausing calls for {_ZOHO_BREAKER_COOLDOWN_SECONDS}s"
+            )
+
+
+def _zoho_request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a Zoho Books API request through the pooled session, retrying
+    transient failures.
+
+    GETs are retried on connection errors, timeouts, 429 and 502/503/504.
+    Other methods are retried only when Zoho cannot have acted on them
+    (connect timeouts and 429), since a POST that failed upstream may still
+    have created the contact.
+    """
+    if time.monotonic() < _zoho_breaker["open_until"]:
+        raise Exception("Zoho Books is temporarily unavailable, please retry shortly")
+
+    if method == "GET":
+        retry_statuses = _ZOHO_RETRY_STATUSES
+        retry_errors = (requests.ConnectionError, requests.Timeout)
+    else:
+        retry_statuses = frozenset({429})
+        retry_errors = (requests.ConnectTimeout,)
+
+    for attempt in range(_ZOHO_MAX_ATTEMPTS):
+        last_attempt = attempt == _ZOHO_MAX_ATTEMPTS - 1
+        retry_after = None
+        try:
+            response = _zoho_session.request(method, url, **kwargs)
+        except retry_errors as e:
+            if last_attempt:
+                _record_zoho_outcome(failed=True)
+                raise
+            logger.warning(f"Zoho {method} attempt {attempt + 1} failed: {e}")
+        except requests.RequestException:
+            _record_zoho_outcome(failed=True)
+            raise
+        else:
+            failed = (
+                response.status_code in _ZOHO_RETRY_STATUSES
+                or response.status_code >= 500
+            )
+            if response.status_code not in retry_statuses or last_attempt:
+                _record_zoho_outcome(failed=failed)
+                return response
+            logger.warning(
+                f"Zoho {method} attempt {attempt + 1} returned {response.status_code}"
+            )
+            if response.headers.get("Retry-After", "").isdigit():
+                retry_after = int(response.headers["Retry-After"])
+
+        delay = min(_ZOHO_BACKOFF_SECONDS * 2**attempt, _ZOHO_MAX_BACKOFF_SECONDS)
+        if retry_after is not None:
+            delay = min(max(delay, retry_after), _ZOHO_MAX_BACKOFF_SECONDS)
+        time.sleep(delay + random.uniform(0, _ZOHO_BACKOFF_SECONDS))
+
 
 class AddressModel(BaseModel):
     """Structured address following Zoho Books API format"""
@@ -210,6 +389,30 @@ INDIAN_STATE_CODES = {
     "west bengal": "WB",
 }
 
+# Old names and common spellings that would otherwise fall through to Zoho
+# as free text and be rejected
+INDIAN_STATE_ALIASES = {
+    "orissa": "OD",
+    "pondicherry": "PY",
+    "uttaranchal": "UK",
+    "nct of delhi": "DL",
+    "new delhi": "DL",
+    "j and k": "JK",
+    "andaman and nicobar": "AN",
+    "dadra and nagar haveli": "DN",
+}
+
+# Punctuation is dropped (and "&" spelled out) before lookup so that
+# "Jammu & Kashmir" and "Tamil-Nadu" resolve like their canonical names
+_STATE_NAME_PUNCT = str.maketrans({"&": " and ", ".": " ", ",": " ", "-": " ", "_": " "})
+
+# Normalised name -> code, including space-less variants ("tamilnadu") and
+# the codes themselves so an already-coded value passes straight through
+_STATE_LOOKUP = {code.lower(): code for code in INDIAN_STATE_CODES.values()}
+for _name, _code in (*INDIAN_STATE_CODES.items(), *INDIAN_STATE_ALIASES.items()):
+    _STATE_LOOKUP[_name] = _code
+    _STATE_LOOKUP.setdefault(_name.replace(" ", ""), _code)
+
 
 def get_state_code(state_name: str) -> str:
     """
@@ -219,12 +422,14 @@ def get_state_code(state_name: str) -> str:
     if not state_name:
         return ""
 
-    # Try exact match (case-insensitive)
-    state_code = INDIAN_STATE_CODES.get(state_name.lower().strip())
+    # Case-, punctuation- and whitespace-insensitive match
+    key = " ".join(state_name.translate(_STATE_NAME_PUNCT).lower().split())
+    state_code = _STATE_LOOKUP.get(key) or _STATE_LOOKUP.get(key.replace(" ", ""))
     if state_code:
         return state_code
 
     # If not found, return the original state name
+    logger.warning(f"No state code mapping for state: {state_name!r}")
     return state_name
 
 
@@ -393,10 +598,14 @@ def store_customer_in_db(contact_data: Dict[str, Any], db) -> bool:
         return False
 
 
-def get_zoho_books_access_token() -> Optional[str]:
+def get_zoho_books_access_token(force_refresh: bool = False) -> Optional[str]:
     """
     Get access token for Zoho Books API using refresh token.
 
+    Served from the shared Books token cache (see helpers.get_access_token), so
+    approvals reuse the token the rest of the app holds instead of minting a
+    new one each time; force_refresh mints a new one regardless.
+
     Returns:
         str: Access token if successful, None otherwise
 
@@ -408,45 +617,10 @@ def get_zoho_books_access_token() -> Optional[str]:
         raise Exception("Missing Zoho Books configuration in environment variables")
 
     try:
-        url = BOOKS_URL.format(
-            clientId=CLIENT_ID,
-            clientSecret=CLIENT_SECRET,
-            grantType=GRANT_TYPE,
-            books_refresh_token=BOOKS_REFRESH_TOKEN,
-        )
-
-        response = requests.post(url, timeout=30)
-
-        if response.status_code == 200:
-            data = response.json()
-            access_token = data.get("access_token", "")
-            logger.info(f"Got Zoho Books Access Token: ...{access_token[-4:]}")
-            return access_token
-        else:
-            # Parse the JSON response to get detailed error information
-            try:
-                error_response = response.json()
-                error_msg = (
-                    error_response.get("error_description")
-                    or error_response.get("message")
-                    or response.text
-                )
-            except:
-                error_msg = response.text
-
-            logger.error(
-                f"Failed to get access token: {response.status_code} - {response.text}"
-            )
-            raise Exception(f"Failed to get Zoho access token: {error_msg}")
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error getting Zoho Books access token: {e}")
-        raise Exception(f"Network error while getting Zoho access token: {str(e)}")
-    except Exception as e:
-        if "Failed to get Zoho access token" in str(e):
-            raise
-        logger.error(f"Error getting Zoho Books access token: {e}")
-        raise Exception(f"Error getting Zoho access token: {str(e)}")
+        return get_access_token("books", force_refresh=force_refresh)
+    except HTTPException as e:
+        logger.error(f"Failed to get access token: {e.detail}")
+        raise Exception(f"Failed to get Zoho access token: {e.detail}")
 
 
 def get_zoho_custom_fields() -> Optional[List[Dict[str, Any]]]:
@@ -476,7 +650,7 @@ def get_zoho_custom_fields() -> Optional[List[Dict[str, Any]]]:
     }
 
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = _zoho_request("GET", url, headers=headers, timeout=30)
 
         if response.status_code == 200:
             data = response.json()
@@ -706,16 +880,7 @@ def create_zoho_contact(
 
     # Build the contact payload according to Zoho Books API
     payment_terms_label = customer_data.get("payment_terms", "")
-    payment_terms_days_map = {
-        "Due On Receipt": 0,
-        "Upfront": 0,
-        "Immediate": 0,
-        "Net 15": 15,
-        "Net 30": 30,
-        "Net 45": 45,
-        "Net 60": 60,
-    }
-    payment_terms_days = payment_terms_days_map.get(payment_terms_label, 0)
+    payment_terms_days = ZOHO_PAYMENT_TERMS_DAYS.get(payment_terms_label, 0)
 
     contact_payload = {
         "contact_name": customer_data.get("shop_name", ""),
@@ -844,13 +1009,7 @@ def create_zoho_contact(
 
     if customer_data.get("gst_treatment"):
         # Map GST treatment to Zoho format
-        gst_treatment_map = {
-            "Business GST": "business_gst",
-            "Unregistered Business": "business_none",
-            "Consumer": "consumer",
-            "Overseas": "overseas",
-        }
-        zoho_gst_treatment = gst_treatment_map.get(
+        zoho_gst_treatment = ZOHO_GST_TREATMENTS.get(
             customer_data.get("gst_treatment"), "business_gst"
         )
         contact_payload["gst_treatment"] = zoho_gst_treatment
@@ -864,14 +1023,15 @@ def create_zoho_contact(
             customer_data.get("place_of_supply")
         )
 
-    # Add notes with additional details
-    notes_parts = []
     if customer_data.get("pan_card_no"):
         contact_payload["pan_no"] = customer_data.get("pan_card_no")
-    if customer_data.get("margin_details"):
-        notes_parts.append(f"Margin Details: {customer_data.get('margin_details')}")
-    if customer_data.get("sales_person"):
-        notes_parts.append(f"Sales Person: {customer_data.get('sales_person')}")
+
+    # Add notes with additional details
+    notes_parts = [
+        f"{label}: {customer_data[field]}"
+        for field, label in ZOHO_NOTE_FIELDS
+        if customer_data.get(field)
+    ]
 
     if notes_parts:
         contact_payload["notes"] = "\n".join(notes_parts)
@@ -881,7 +1041,18 @@ def create_zoho_contact(
         logger.info(f"Zoho Contact Payload: {contact_payload}")
         logger.info(f"Custom Fields Being Sent: {custom_fields}")
 
-        response = requests.post(url, json=contact_payload, headers=headers, timeout=30)
+        response = _zoho_request(
+            "POST", url, json=contact_payload, headers=headers, timeout=30
+        )
+        if response.status_code == 401:
+            # The cached token was revoked or expired early; nothing was
+            # created, so retry once with a freshly minted one
+            headers["Authorization"] = (
+                f"Zoho-oauthtoken {get_zoho_books_access_token(force_refresh=True)}"
+            )
+            response = _zoho_request(
+                "POST", url, json=contact_payload, headers=headers, timeout=30
+            )
 
         if response.status_code == 201:
             response_data = response.json()
@@ -926,9 +1097,25 @@ def create_zoho_contact(
         }
 
 
+def _notify_admins_of_new_request(db, customer_name: str, sp_first_name: str):
+    try:
+        # In-app notification to admins
+        create_notifications_for_emails(
+            db,
+            ADMIN_NOTIFICATION_EMAILS,
+            "customer_request_submitted",
+            f"New customer request: {customer_name}",
+            f"{sp_first_name} submitted a new customer creation request.",
+            f"/admin/customer_requests",
+        )
+    except Exception as e:
+        logger.error(f"Failed to send WhatsApp notification to admin: {e}")
+
+
 @router.post("/")
-async def create_customer_request(
+def create_customer_request(
     request_data: CustomerCreationRequest,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user),
 ):
     """Create a new customer creation request"""
@@ -962,36 +1149,10 @@ async def create_customer_request(
                 user_data.get("email") or user_data.get("code") or "Unknown User"
             )
 
-        # Prepare the request document
+        # Prepare the request document: every form field (addresses dumped to
+        # dicts, unset ones as None) plus the bookkeeping fields
         request_doc = {
-            "shop_name": request_data.shop_name,
-            "customer_name": request_data.customer_name,
-            "gst_no": request_data.gst_no,
-            "pan_card_no": request_data.pan_card_no,
-            "whatsapp_no": request_data.whatsapp_no,
-            "payment_terms": request_data.payment_terms,
-            "multiple_branches": request_data.multiple_branches,
-            "tier_category": request_data.tier_category,
-            "sales_person": request_data.sales_person,
-            "margin_details": request_data.margin_details,
-            "billing_address": (
-                request_data.billing_address.model_dump()
-                if request_data.billing_address
-                else None
-            ),
-            "shipping_address": (
-                request_data.shipping_address.model_dump()
-                if request_data.shipping_address
-                else None
-            ),
-            "place_of_supply": request_data.place_of_supply,
-            "customer_mail_id": request_data.customer_mail_id,
-            "gst_treatment": request_data.gst_treatment,
-            "in_ex": request_data.in_ex,
-            "pincode": request_data.pincode,
-            "gst_certificate_url": request_data.gst_certificate_url,
-            "pan_card_url": request_data.pan_card_url,
-            "aadhar_url": request_data.aadhar_url,
+            **request_data.model_dump(),
             "created_by": user_id,
             "created_by_name": created_by_name,
             "created_at": datetime.now(),
@@ -1001,29 +1162,24 @@ async def create_customer_request(
         # Insert into database
         result = db.customer_creation_requests.insert_one(request_doc)
 
-        # Notify admins (current admin + invoicee admin) of the new request
-        try:
-            sp_first_name = user_data.get("first_name", "Sales Person")
-
-            # In-app notification to admins
-            create_notifications_for_emails(
-                db,
-                ADMIN_NOTIFICATION_EMAILS,
-                "customer_request_submitted",
-                f"New customer request: {request_data.customer_name}",
-                f"{sp_first_name} submitted a new customer creation request.",
-                f"/admin/customer_requests",
-            )
-        except Exception as e:
-            logger.error(f"Failed to send WhatsApp notification to admin: {e}")
+        # Notify admins (current admin + invoicee admin) of the new request,
+        # after the response is sent; the client doesn't wait on the fan-out
+        background_tasks.add_task(
+            _notify_admins_of_new_request,
+            db,
+            request_data.customer_name,
+            user_data.get("first_name", "Sales Person"),
+        )
 
         return {
             "message": "Customer creation request submitted successfully",
             "request_id": str(result.inserted_id),
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error creating customer request: {e}")
+        logger.error(f"Error creating customer request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -1059,7 +1215,9 @@ async def upload_customer_document(
 
     try:
         s3 = _get_s3_client()
-        s3.put_object(
+        # Blocking boto3 call; keep it off the event loop
+        await asyncio.to_thread(
+            s3.put_object,
             Bucket=S3_BUCKET_NAME,
             Key=s3_key,
             Body=content,
@@ -1075,7 +1233,7 @@ async def upload_customer_document(
 
 
 @router.delete("/document")
-async def delete_customer_document(
+def delete_customer_document(
     key: str,
     current_user: dict = Depends(get_current_user),
 ):
@@ -1093,14 +1251,52 @@ async def delete_customer_document(
     return {"message": "Document deleted successfully"}
 
 
+def _encode_page_cursor(doc: Dict[str, Any]) -> str:
+    """Opaque list cursor pointing just past `doc` in newest-first order.
+
+    URL-safe base64 (unpadded) of the JSON array [created_at ISO string, _id].
+    """
+    raw = orjson.dumps([doc["created_at"].isoformat(), str(doc["_id"])])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_page_cursor(cursor: str) -> Dict[str, Any]:
+    """$match condition for the requests that follow the cursor's position."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, oid = orjson.loads(raw)
+        created_at, oid = datetime.fromisoformat(created_at), ObjectId(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": oid}},
+        ]
+    }
+
+
 @router.get("/")
-async def get_customer_requests(
+def get_customer_requests(
+    request: Request,
     current_user: dict = Depends(get_current_user),
     page: int = 1,
     limit: int = 10,
     status: Optional[str] = None,
+    cursor: Optional[str] = None,
 ):
-    """Get customer creation requests - admins see all, sales people see only their own"""
+    """Get customer creation requests - admins see all, sales people see only their own
+
+    Pages by `page`, or, when `cursor` (a previous response's next_cursor) is
+    given, continues straight after that request without skipping over the
+    earlier pages. The two can't be combined, and cursor-paged responses
+    have no page number.
+    """
+    if cursor and page > 1:
+        raise HTTPException(
+            status_code=400, detail="Use either page or cursor, not both"
+        )
+    after_cursor = _decode_page_cursor(cursor) if cursor else None
     try:
         db = get_database()
 
@@ -1119,19 +1315,32 @@ async def get_customer_requests(
         if status:
             filter_query["status"] = status
 
-        skip = (page - 1) * limit
-
-        total_count = db.customer_creation_requests.count_documents(filter_query)
-
+        # The page sorts and pages before joining, so the lookups run for the
+        # rows returned rather than every match. It runs as a plain pipeline
+        # rather than a $facet branch so the sort can use the list indexes and
+        # the rows are not capped by the 16MB single-document limit. _id breaks
+        # created_at ties so a cursor position is exact; a cursor joins the
+        # filter in the leading $match, so the index seeks straight to its
+        # position instead of skipping over earlier pages.
+        page_match = {**filter_query, **(after_cursor or {})}
+        paging = [] if after_cursor else [{"$skip": (page - 1) * limit}]
         pipeline = [
-            {"$match": filter_query},
+            {"$match": page_match},
+            {"$sort": {"created_at": -1, "_id": -1}},
+            *paging,
+            {"$limit": limit},
 
-            # Lookup customers collection
+            # Lookup customers collection. Only company_name is read from the
+            # Zoho contact, so only it is joined rather than the whole record.
             {
                 "$lookup": {
                     "from": "customers",
                     "localField": "zoho_contact_id",
                     "foreignField": "contact_id",
+                    "pipeline": [
+                        {"$limit": 1},
+                        {"$project": {"_id": 0, "company_name": 1}},
+                    ],
                     "as": "customer_data",
                 }
             },
@@ -1157,10 +1366,6 @@ async def get_customer_requests(
                 }
             },
 
-            {"$sort": {"created_at": -1}},
-            {"$skip": skip},
-            {"$limit": limit},
-
             # Lookup the customer login (users doc) linked to this Zoho customer
             {
                 "$lookup": {
@@ -1204,23 +1409,81 @@ async def get_customer_requests(
         ]
 
         requests = list(db.customer_creation_requests.aggregate(pipeline))
+        total_count = db.customer_creation_requests.count_documents(filter_query)
+        next_cursor = None
+        if len(requests) == limit and requests[-1].get("created_at"):
+            next_cursor = _encode_page_cursor(requests[-1])
 
-        serialized_requests = [serialize_mongo_document(req) for req in requests]
+        # Returned as a response so the documents skip jsonable_encoder; the
+        # ObjectIds and datetimes in them are converted by orjson
+        response = MongoJSONResponse(
+            {
+                "requests": requests,
+                "total_count": total_count,
+                "page": None if cursor else page,
+                "per_page": limit,
+                "next_cursor": next_cursor,
+            }
+        )
 
-        return {
-            "requests": serialized_requests,
-            "total_count": total_count,
-            "page": page,
-            "per_page": limit,
-        }
+        # The list is polled; a client that already holds this exact page gets
+        # a bodiless 304 instead of it again
+        etag = f'"{hashlib.blake2b(response.body, digest_size=16).hexdigest()}"'
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        return response
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error fetching customer requests: {e}")
+        logger.error(f"Error fetching customer requests: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+def _request_oid(
+    request_id: str, current_user: dict = Depends(get_current_user)
+) -> ObjectId:
+    """The request_id path parameter as an ObjectId; a malformed id is a 400
+    rather than a failed lookup. Depends on get_current_user so that
+    authentication is checked before the id is validated."""
+    try:
+        return ObjectId(request_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid request id")
+
+
+def _whatsapp_customer_of_decision(request_doc: dict, approved: bool):
+    # Templates (db.templates / WhatsApp): customer_request_approved,
+    # customer_request_rejected — each expects body vars {{1}}=name, {{2}}=shop.
+    try:
+        tmpl_name = (
+            "customer_request_approved" if approved else "customer_request_rejected"
+        )
+        cust_template = get_template_by_name(tmpl_name)
+        if cust_template:
+            cust_first_name = (request_doc.get("customer_name") or "there").split()[0]
+            send_whatsapp(
+                request_doc.get("whatsapp_no"),
+                cust_template,
+                {
+                    "name": cust_first_name,
+                    "shop": request_doc.get("shop_name", "your shop"),
+                },
+            )
+    except Exception as e:
+        logger.error(f"Failed to send customer WhatsApp notification: {e}")
+
+
 @router.put("/{request_id}/status")
-async def update_request_status(
-    request_id: str, status: str, force_create: bool = False, current_user: dict = Depends(get_current_user)
+def update_request_status(
+    request_id: str,
+    status: str,
+    background_tasks: BackgroundTasks,
+    force_create: bool = False,
+    request_oid: ObjectId = Depends(_request_oid),
+    current_user: dict = Depends(get_current_user),
 ):
     """
     Update the status of a customer creation request (admin only).
@@ -1248,21 +1511,15 @@ async def update_request_status(
             user_id = ObjectId(user_id)
 
         # Validate status - only allow manual changes to these statuses
-        # admin_commented and salesperson_replied are set automatically by comment/reply endpoints
-        allowed_manual_statuses = [
-            "pending",
-            "approved",
-            "rejected",
-        ]
-        if status not in allowed_manual_statuses:
+        if status not in ALLOWED_MANUAL_STATUSES:
             raise HTTPException(
                 status_code=400,
-                detail=f"Invalid status. Must be one of: {allowed_manual_statuses}",
+                detail=f"Invalid status. Must be one of: {list(ALLOWED_MANUAL_STATUSES)}",
             )
 
         # Get the request details
         request_doc = db.customer_creation_requests.find_one(
-            {"_id": ObjectId(request_id)}
+            {"_id": request_oid}
         )
         if not request_doc:
             raise HTTPException(status_code=404, detail="Request not found")
@@ -1362,7 +1619,7 @@ async def update_request_status(
 
         # Update the request
         result = db.customer_creation_requests.update_one(
-            {"_id": ObjectId(request_id)}, {"$set": update_doc}
+            {"_id": request_oid}, {"$set": update_doc}
         )
 
         if result.modified_count == 0:
@@ -1424,42 +1681,28 @@ async def update_request_status(
             except Exception as e:
                 logger.error(f"Failed to send rejection email: {e}")
 
-        # WhatsApp the customer when their request is approved or rejected.
-        # Templates (db.templates / WhatsApp): customer_request_approved,
-        # customer_request_rejected — each expects body vars {{1}}=name, {{2}}=shop.
-        try:
-            cust_phone = request_doc.get("whatsapp_no")
-            if cust_phone and (final_status == "created_on_zoho" or status == "rejected"):
-                tmpl_name = (
-                    "customer_request_approved"
-                    if final_status == "created_on_zoho"
-                    else "customer_request_rejected"
-                )
-                cust_template = db.templates.find_one({"name": tmpl_name})
-                if cust_template:
-                    cust_first_name = (request_doc.get("customer_name") or "there").split()[0]
-                    send_whatsapp(
-                        cust_phone,
-                        cust_template,
-                        {
-                            "name": cust_first_name,
-                            "shop": request_doc.get("shop_name", "your shop"),
-                        },
-                    )
-        except Exception as e:
-            logger.error(f"Failed to send customer WhatsApp notification: {e}")
+        # WhatsApp the customer when their request is approved or rejected,
+        # after the response is sent
+        if request_doc.get("whatsapp_no") and (
+            final_status == "created_on_zoho" or status == "rejected"
+        ):
+            background_tasks.add_task(
+                _whatsapp_customer_of_decision,
+                request_doc,
+                final_status == "created_on_zoho",
+            )
 
         # Send WhatsApp notification to sales person when status is approved or rejected
         try:
-            if status in ["approved", "rejected"] or final_status == "created_on_zoho":
+            if status in ("approved", "rejected") or final_status == "created_on_zoho":
                 # Get the sales person who created the request
                 sp_user_id = request_doc.get("created_by")
                 if sp_user_id:
                     sp_user = db.users.find_one({"_id": ObjectId(sp_user_id)})
 
                     if sp_user and sp_user.get("phone"):
-                        template = db.templates.find_one(
-                            {"name": "sp_customer_creation_request_status"}
+                        template = get_template_by_name(
+                            "sp_customer_creation_request_status"
                         )
 
                         if template:
@@ -1535,13 +1778,14 @@ class CustomerLoginCreate(BaseModel):
 
 
 @router.get("/{request_id}/login")
-async def get_request_login(
-    request_id: str, current_user: dict = Depends(get_current_user)
+def get_request_login(
+    request_oid: ObjectId = Depends(_request_oid),
+    current_user: dict = Depends(get_current_user),
 ):
     """Return the customer login linked to this request's Zoho customer, if any."""
     db = get_database()
 
-    request_doc = db.customer_creation_requests.find_one({"_id": ObjectId(request_id)})
+    request_doc = db.customer_creation_requests.find_one({"_id": request_oid})
     if not request_doc:
         raise HTTPException(status_code=404, detail="Request not found")
 
@@ -1556,15 +1800,15 @@ async def get_request_login(
     if not user:
         return {"login": None}
 
-    login = serialize_mongo_document(user)
-    login["has_password"] = bool(login.pop("password", None))
-    return {"login": login}
+    user["has_password"] = bool(user.pop("password", None))
+    return MongoJSONResponse({"login": user})
 
 
 @router.post("/{request_id}/login")
-async def create_request_login(
+def create_request_login(
     request_id: str,
     body: CustomerLoginCreate,
+    request_oid: ObjectId = Depends(_request_oid),
     current_user: dict = Depends(get_current_user),
 ):
     """
@@ -1581,7 +1825,7 @@ async def create_request_login(
     if user_data.get("role") not in ("admin", "sales_admin"):
         raise HTTPException(status_code=403, detail="Not authorised")
 
-    request_doc = db.customer_creation_requests.find_one({"_id": ObjectId(request_id)})
+    request_doc = db.customer_creation_requests.find_one({"_id": request_oid})
     if not request_doc:
         raise HTTPException(status_code=404, detail="Request not found")
 
@@ -1640,7 +1884,7 @@ async def create_request_login(
         "status": "active",
         "customer_id": contact_id,
         "customer_name": customer_name,
-        "created_from_request_id": ObjectId(request_id),
+        "created_from_request_id": request_oid,
         "created_at": now,
         "updated_at": now,
     }
@@ -1654,7 +1898,7 @@ async def create_request_login(
     result = db.users.insert_one(doc)
 
     db.customer_creation_requests.update_one(
-        {"_id": ObjectId(request_id)},
+        {"_id": request_oid},
         {"$set": {"linked_user_id": result.inserted_id, "updated_at": now}},
     )
 
@@ -1677,8 +1921,9 @@ async def create_request_login(
 
 
 @router.post("/{request_id}/login/send")
-async def send_login_instructions(
-    request_id: str, current_user: dict = Depends(get_current_user)
+def send_login_instructions(
+    request_oid: ObjectId = Depends(_request_oid),
+    current_user: dict = Depends(get_current_user),
 ):
     """
     WhatsApp the customer their login instructions via Plivo.
@@ -1700,7 +1945,7 @@ async def send_login_instructions(
     if user_data.get("role") not in ("admin", "sales_admin"):
         raise HTTPException(status_code=403, detail="Not authorised")
 
-    request_doc = db.customer_creation_requests.find_one({"_id": ObjectId(request_id)})
+    request_doc = db.customer_creation_requests.find_one({"_id": request_oid})
     if not request_doc:
         raise HTTPException(status_code=404, detail="Request not found")
 
@@ -1723,7 +1968,7 @@ async def send_login_instructions(
         )
     phone10 = resolved["phone"]
 
-    template = db.templates.find_one({"name": CUSTOMER_LOGIN_TEMPLATE_NAME})
+    template = get_template_by_name(CUSTOMER_LOGIN_TEMPLATE_NAME)
     if not template:
         raise HTTPException(
             status_code=400,
@@ -1751,10 +1996,49 @@ async def send_login_instructions(
     return {"message": f"Login instructions sent on WhatsApp to {phone10}"}
 
 
+def _notify_salesperson_of_comment(db, created_by, admin_name: str, request_id: str):
+    try:
+        # Get salesperson details
+        salesperson = db.users.find_one({"_id": created_by})
+        if salesperson:
+            # Get WhatsApp template
+            template = get_template_by_name(
+                "admin_comment_customer_creation_request"
+            )
+            if template and salesperson.get("phone"):
+                # Prepare parameters for template
+                params = {
+                    "admin_name": admin_name,
+                    "sales_person_name": f"{salesperson.get('first_name', '')} {salesperson.get('last_name', '')}".strip()
+                    or salesperson.get("email")
+                    or "Salesperson",
+                    "button_url": request_id,
+                }
+
+                # send_whatsapp(salesperson.get("phone"), template, params)
+                # logger.info(
+                #     f"WhatsApp notification sent to salesperson: {salesperson.get('email')}"
+                # )
+
+                # In-app notification to salesperson
+                create_notification(
+                    db,
+                    str(salesperson["_id"]),
+                    "customer_request_comment",
+                    f"Comment on customer request",
+                    f"{admin_name} added a comment on your customer request.",
+                    f"/customer_requests",
+                )
+    except Exception as e:
+        logger.error(f"Failed to send WhatsApp notification: {e}")
+
+
 @router.post("/{request_id}/comments")
-async def add_comment(
+def add_comment(
     request_id: str,
     comment_data: CommentCreate,
+    background_tasks: BackgroundTasks,
+    request_oid: ObjectId = Depends(_request_oid),
     current_user: dict = Depends(get_current_user),
 ):
     """Add an admin comment to a customer creation request"""
@@ -1783,76 +2067,85 @@ async def add_comment(
             "reply": None,
         }
 
-        # Add comment to the request and update status
-        result = db.customer_creation_requests.update_one(
-            {"_id": ObjectId(request_id)},
+        # Add comment to the request and update status, reading back the
+        # request's creator for the notification in the same round trip
+        customer_request = _comment_writes.find_one_and_update(
+            {"_id": request_oid},
             {
                 "$push": {"admin_comments": comment},
                 "$set": {"status": "admin_commented"},
             },
+            projection={"created_by": 1},
         )
 
-        if result.modified_count == 0:
+        if customer_request is None:
             raise HTTPException(status_code=404, detail="Request not found")
 
-        # Send WhatsApp notification to salesperson
-        try:
-            # Get the customer request to find the salesperson
-            customer_request = db.customer_creation_requests.find_one(
-                {"_id": ObjectId(request_id)}
-            )
-            if customer_request:
-                # Get salesperson details
-                salesperson = db.users.find_one(
-                    {"_id": customer_request.get("created_by")}
-                )
-                if salesperson:
-                    # Get WhatsApp template
-                    template = db.templates.find_one(
-                        {"name": "admin_comment_customer_creation_request"}
-                    )
-                    if template and salesperson.get("phone"):
-                        # Prepare parameters for template
-                        params = {
-                            "admin_name": admin_name,
-                            "sales_person_name": f"{salesperson.get('first_name', '')} {salesperson.get('last_name', '')}".strip()
-                            or salesperson.get("email")
-                            or "Salesperson",
-                            "button_url": request_id,
-                        }
-
-                        # send_whatsapp(salesperson.get("phone"), template, params)
-                        # print(
-                        #     f"WhatsApp notification sent to salesperson: {salesperson.get('email')}"
-                        # )
-
-                        # In-app notification to salesperson
-                        create_notification(
-                            db,
-                            str(salesperson["_id"]),
-                            "customer_request_comment",
-                            f"Comment on customer request",
-                            f"{admin_name} added a comment on your customer request.",
-                            f"/customer_requests",
-                        )
-        except Exception as e:
-            print(f"Failed to send WhatsApp notification: {e}")
+        # Notify the salesperson after the response is sent
+        background_tasks.add_task(
+            _notify_salesperson_of_comment,
+            db,
+            customer_request.get("created_by"),
+            admin_name,
+            request_id,
+        )
 
         return {
             "message": "Comment added successfully",
-            "comment": serialize_mongo_document(comment),
+            "comment": comment,
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error adding comment: {e}")
+        logger.error(f"Error adding comment: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _notify_admin_of_reply(db, admin_id, sales_person_name: str, request_id: str):
+    try:
+        # Get admin details
+        admin = db.users.find_one({"_id": ObjectId(admin_id)})
+        if admin:
+            # Get WhatsApp template
+            template = get_template_by_name(
+                "sp_reply_comment_customer_creation_request"
+            )
+            if template and admin.get("phone"):
+                # Prepare parameters for template
+                params = {
+                    "sales_person_name": sales_person_name,
+                    "admin_name": f"{admin.get('first_name', '')} {admin.get('last_name', '')}".strip()
+                    or admin.get("email")
+                    or "Admin",
+                    "button_url": request_id,
+                }
+
+                # send_whatsapp(admin.get("phone"), template, params)
+                # logger.info(
+                #     f"WhatsApp notification sent to admin: {admin.get('email')}"
+                # )
+
+                # In-app notification to admin
+                create_notification(
+                    db,
+                    str(admin["_id"]),
+                    "customer_request_reply",
+                    f"Reply on customer request",
+                    f"{sales_person_name} replied to your comment.",
+                    f"/admin/customer_requests",
+                )
+    except Exception as e:
+        logger.error(f"Failed to send WhatsApp notification: {e}")
+
+
 @router.post("/{request_id}/comments/{comment_id}/reply")
-async def add_reply(
+def add_reply(
     request_id: str,
     comment_id: str,
     reply_data: ReplyCreate,
+    background_tasks: BackgroundTasks,
+    request_oid: ObjectId = Depends(_request_oid),
     current_user: dict = Depends(get_current_user),
 ):
     """Add a reply to an admin comment (from sales person)"""
@@ -1869,92 +2162,53 @@ async def add_reply(
             "updated_at": None,
         }
 
-        # Update the specific comment with the reply and change status
-        result = db.customer_creation_requests.update_one(
-            {"_id": ObjectId(request_id), "admin_comments._id": comment_id},
+        # Update the specific comment with the reply and change status. The
+        # comment comes back in the same round trip, for the admin notification.
+        updated = _comment_writes.find_one_and_update(
+            {"_id": request_oid, "admin_comments._id": comment_id},
             {
                 "$set": {
                     "admin_comments.$.reply": reply,
                     "status": "salesperson_replied",
                 }
             },
+            projection={"admin_comments.$": 1},
         )
 
-        if result.modified_count == 0:
+        if updated is None:
             raise HTTPException(status_code=404, detail="Request or comment not found")
 
-        # Send WhatsApp notification to admin
-        try:
-            # Get the customer request to find the comment and admin
-            customer_request = db.customer_creation_requests.find_one(
-                {"_id": ObjectId(request_id)}
-            )
-            if customer_request and customer_request.get("admin_comments"):
-                # Find the specific comment to get admin details
-                target_comment = None
-                for comment in customer_request.get("admin_comments", []):
-                    if comment.get("_id") == comment_id:
-                        target_comment = comment
-                        break
-
-                if target_comment:
-                    # Get admin details
-                    admin = db.users.find_one(
-                        {"_id": ObjectId(target_comment.get("admin_id"))}
-                    )
-                    if admin:
-                        # Get WhatsApp template
-                        template = db.templates.find_one(
-                            {"name": "sp_reply_comment_customer_creation_request"}
-                        )
-                        if template and admin.get("phone"):
-                            # Prepare parameters for template
-                            params = {
-                                "sales_person_name": reply_data.user_name,
-                                "admin_name": f"{admin.get('first_name', '')} {admin.get('last_name', '')}".strip()
-                                or admin.get("email")
-                                or "Admin",
-                                "button_url": request_id,
-                            }
-
-                            # send_whatsapp(admin.get("phone"), template, params)
-                            # print(
-                            #     f"WhatsApp notification sent to admin: {admin.get('email')}"
-                            # )
-
-                            # In-app notification to admin
-                            create_notification(
-                                db,
-                                str(admin["_id"]),
-                                "customer_request_reply",
-                                f"Reply on customer request",
-                                f"{reply_data.user_name} replied to your comment.",
-                                f"/admin/customer_requests",
-                            )
-        except Exception as e:
-            print(f"Failed to send WhatsApp notification: {e}")
+        # Notify the commenting admin after the response is sent
+        target_comment = updated["admin_comments"][0]
+        background_tasks.add_task(
+            _notify_admin_of_reply,
+            db,
+            target_comment.get("admin_id"),
+            reply_data.user_name,
+            request_id,
+        )
 
         return {"message": "Reply added successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error adding reply: {e}")
+        logger.error(f"Error adding reply: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.put("/{request_id}/comments/{comment_id}/reply")
-async def update_reply(
-    request_id: str,
+def update_reply(
     comment_id: str,
     reply_data: ReplyCreate,
+    request_oid: ObjectId = Depends(_request_oid),
     current_user: dict = Depends(get_current_user),
 ):
     """Update a reply to an admin comment"""
     try:
-        db = get_database()
-
         # Update the reply text and updated_at timestamp
-        result = db.customer_creation_requests.update_one(
-            {"_id": ObjectId(request_id), "admin_comments._id": comment_id},
+        result = _comment_writes.update_one(
+            {"_id": request_oid, "admin_comments._id": comment_id},
             {
                 "$set": {
                     "admin_comments.$.reply.text": reply_data.reply,
@@ -1968,22 +2222,24 @@ async def update_reply(
 
         return {"message": "Reply updated successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error updating reply: {e}")
+        logger.error(f"Error updating reply: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.delete("/{request_id}/comments/{comment_id}/reply")
-async def delete_reply(
-    request_id: str, comment_id: str, current_user: dict = Depends(get_current_user)
+def delete_reply(
+    comment_id: str,
+    request_oid: ObjectId = Depends(_request_oid),
+    current_user: dict = Depends(get_current_user),
 ):
     """Delete a reply to an admin comment"""
     try:
-        db = get_database()
-
         # Remove the reply from the comment
-        result = db.customer_creation_requests.update_one(
-            {"_id": ObjectId(request_id), "admin_comments._id": comment_id},
+        result = _comment_writes.update_one(
+            {"_id": request_oid, "admin_comments._id": comment_id},
             {"$set": {"admin_comments.$.reply": None}},
         )
 
@@ -1992,15 +2248,17 @@ async def delete_reply(
 
         return {"message": "Reply deleted successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error deleting reply: {e}")
+        logger.error(f"Error deleting reply: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.put("/{request_id}")
-async def update_customer_request(
-    request_id: str,
+def update_customer_request(
     request_data: CustomerCreationRequest,
+    request_oid: ObjectId = Depends(_request_oid),
     current_user: dict = Depends(get_current_user),
 ):
     """Update a customer creation request (by creator or admin)"""
@@ -2017,7 +2275,7 @@ async def update_customer_request(
 
         # Find the existing request
         existing_request = db.customer_creation_requests.find_one(
-            {"_id": ObjectId(request_id)}
+            {"_id": request_oid}
         )
         if not existing_request:
             raise HTTPException(status_code=404, detail="Request not found")
@@ -2032,7 +2290,7 @@ async def update_customer_request(
         # Check if user has permission to edit (creator or admin)
         user_role = user_data.get("role", "")
         is_creator = existing_request.get("created_by") == user_id
-        is_admin = user_role not in ["sales_person"]
+        is_admin = user_role != "sales_person"
 
         if not (is_creator or is_admin):
             raise HTTPException(
@@ -2041,41 +2299,14 @@ async def update_customer_request(
 
         # Prepare update document
         update_doc = {
-            "shop_name": request_data.shop_name,
-            "customer_name": request_data.customer_name,
-            "gst_no": request_data.gst_no,
-            "pan_card_no": request_data.pan_card_no,
-            "whatsapp_no": request_data.whatsapp_no,
-            "payment_terms": request_data.payment_terms,
-            "multiple_branches": request_data.multiple_branches,
-            "tier_category": request_data.tier_category,
-            "sales_person": request_data.sales_person,
-            "margin_details": request_data.margin_details,
-            "billing_address": (
-                request_data.billing_address.model_dump()
-                if request_data.billing_address
-                else None
-            ),
-            "shipping_address": (
-                request_data.shipping_address.model_dump()
-                if request_data.shipping_address
-                else None
-            ),
-            "place_of_supply": request_data.place_of_supply,
-            "customer_mail_id": request_data.customer_mail_id,
-            "gst_treatment": request_data.gst_treatment,
-            "pincode": request_data.pincode,
-            "in_ex": request_data.in_ex,
-            "gst_certificate_url": request_data.gst_certificate_url,
-            "pan_card_url": request_data.pan_card_url,
-            "aadhar_url": request_data.aadhar_url,
+            **request_data.model_dump(),
             "updated_at": datetime.now(),
             "updated_by": user_id,
         }
 
         # Update the request
         result = db.customer_creation_requests.update_one(
-            {"_id": ObjectId(request_id)}, {"$set": update_doc}
+            {"_id": request_oid}, {"$set": update_doc}
         )
 
         if result.modified_count == 0:
@@ -2085,8 +2316,10 @@ async def update_customer_request(
 
         return {"message": "Customer creation request updated successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error updating customer request: {e}")
+        logger.error(f"Error updating customer request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -2130,17 +2363,17 @@ def _require_self_registered_customer(current_user: dict) -> ObjectId:
 
 
 @router.get("/mine")
-async def get_my_self_service_request(current_user: dict = Depends(get_current_user)):
+def get_my_self_service_request(current_user: dict = Depends(get_current_user)):
     """Fetch the caller's own customer-creation request (for prefilling the form
     and showing approval status). Returns null if they haven't submitted yet."""
     db = get_database()
     user_id = _require_self_registered_customer(current_user)
     doc = db.customer_creation_requests.find_one({"linked_user_id": user_id})
-    return {"request": serialize_mongo_document(doc) if doc else None}
+    return MongoJSONResponse({"request": doc})
 
 
 @router.get("/my-customer")
-async def get_my_customer(current_user: dict = Depends(get_current_user)):
+def get_my_customer(current_user: dict = Depends(get_current_user)):
     """Read-only view of the caller's own linked Zoho customer record + addresses.
     Works for any customer who has a `customer_id` (self-registered-and-approved
     OR an existing internal customer). Returns null if not yet linked."""
@@ -2174,7 +2407,7 @@ async def get_my_customer(current_user: dict = Depends(get_current_user)):
 
 
 @router.post("/self-service")
-async def submit_self_service_profile(
+def submit_self_service_profile(
     body: SelfServiceProfile,
     response: Response,
     current_user: dict = Depends(get_current_user),
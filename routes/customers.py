@@ -6,6 +6,10 @@ import re, requests, os, json, time
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 from .helpers import get_access_token
+from .customer_analytics import (
+    ANALYTICS_CUSTOMER_FIELDS,
+    clear_customer_analytics_cache,
+)
 from PIL import Image
 from io import BytesIO
 import boto3, traceback
@@ -495,6 +499,8 @@ async def update_customer(customer_id: str, product: dict):
         {"_id": ObjectId(customer_id)},
         {"$set": update_data},
     )
+    if ANALYTICS_CUSTOMER_FIELDS.intersection(update_data):
+        clear_customer_analytics_cache()
 
     # Prepare payload for Zoho API if 'cf_sales_person' is updated
     if "cf_sales_person" in update_data:
@@ -113,14 +113,75 @@ def get_subscriber_ids(db, notification_type: str) -> list:
 
 
 def _fanout(db, recipient_ids, notification_type, title, body, link, extra=None):
-    """Send one notification to a de-duplicated set of recipients."""
-    seen = set()
-    for rid in recipient_ids:
-        rid = str(rid)
-        if rid in seen:
+    """Send one notification to a de-duplicated set of recipients.
+
+    Applies create_notification's rules (skip muted types and identical
+    existing notifications) to the whole set at once: one read for each rule
+    and a single insert_many, rather than three round trips per recipient.
+    """
+    oids = [
+        ObjectId(rid)
+        for rid in dict.fromkeys(str(rid) for rid in recipient_ids)
+        if ObjectId.is_valid(rid)
+    ]
+    if not oids:
+        return
+    # Like create_notification, a failed preferences or duplicate read means
+    # "send anyway" rather than dropping the notification for everyone
+    try:
+        muted = {
+            p["user_id"]
+            for p in db.notification_preferences.find(
+                {"user_id": {"$in": oids}, "disabled_types": notification_type},
+                {"user_id": 1},
+            )
+        }
+    except Exception as e:
+        print(f"[notifications] Failed to read preferences for {notification_type}: {e}")
+        muted = set()
+    try:
+        existing = {
+            n["recipient_id"]
+            for n in db.order_form_notifications.find(
+                {
+                    "recipient_id": {"$in": oids},
+                    "type": notification_type,
+                    "title": title,
+                    "link": link,
+                },
+                {"recipient_id": 1},
+            )
+        }
+    except Exception as e:
+        print(f"[notifications] Failed to check existing {notification_type}: {e}")
+        existing = set()
+
+    now = datetime.datetime.utcnow()
+    docs = []
+    for oid in oids:
+        if oid in muted or oid in existing:
             continue
-        seen.add(rid)
-        create_notification(db, rid, notification_type, title, body, link, extra)
+        doc = {
+            "recipient_id": oid,
+            "type": notification_type,
+            "title": title,
+            "body": body,
+            "link": link,
+            "read": False,
+            "created_at": now,
+        }
+        if extra:
+            doc["extra"] = extra
+        docs.append(doc)
+    if not docs:
+        return
+    try:
+        db.order_form_notifications.insert_many(docs, ordered=False)
+    except Exception as e:
+        print(
+            f"[notifications] Failed to fan out {notification_type} "
+            f"to {len(docs)} recipients: {e}"
+        )
 
 
 def create_notification(
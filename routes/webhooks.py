@@ -4,6 +4,10 @@ from ..config.scheduler import schedule_job, remove_scheduled_jobs
 from ..config.whatsapp import send_whatsapp
 from .helpers import get_access_token
 from .notifications import create_notification
+from .customer_analytics import (
+    ANALYTICS_CUSTOMER_FIELDS,
+    clear_customer_analytics_cache,
+)
 from ..config.crons import process_purchase_order_data, refresh_preorder_upcoming_stock
 from dotenv import load_dotenv
 import datetime, json, os, requests, time, threading
@@ -804,6 +808,7 @@ def handle_invoice(data: dict):
                 {"$set": {**invoice, "updated_at": datetime.datetime.now()}},
             )
             print("New Invoice Data Updated")
+        clear_customer_analytics_cache()
         if invoice_status == "paid":
             print(
                 f"Invoice {invoice_id} is marked as 'paid'. Removing all scheduled jobs."
@@ -1163,6 +1168,7 @@ def handle_customer(data: dict):
             }
         )
         print("New customer inserted.")
+        clear_customer_analytics_cache()
     else:
         print("Customer exists. Checking for updates...")
 
@@ -1250,6 +1256,8 @@ def handle_customer(data: dict):
                 {"contact_id": contact_id},
                 {"$set": update_fields, "$unset": {key: "" for key in UNWANTED_KEYS}},
             )
+            if ANALYTICS_CUSTOMER_FIELDS.intersection(update_fields):
+                clear_customer_analytics_cache()
             # Convert datetime to string for JSON serialization
             update_fields_serialized = {
                 key: (
@@ -2010,6 +2018,7 @@ def handle_delete_invoice(data: dict):
     if invoice_id:
         result = db.invoices.delete_one({"invoice_id": invoice_id})
         print(f"Deleted invoice {invoice_id}: {result.deleted_count} document(s) removed")
+        clear_customer_analytics_cache()
     else:
         print("No invoice_id found in delete webhook")
 
@@ -2100,6 +2109,7 @@ def handle_delete_customer(data: dict):
     if contact_id:
         result = db.customers.delete_one({"contact_id": contact_id})
         print(f"Deleted customer {contact_id}: {result.deleted_count} document(s) removed")
+        clear_customer_analytics_cache()
     else:
         print("No contact_id found in customer delete webhook")
 
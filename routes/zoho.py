@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from ..config.root import get_database
 from .helpers import get_access_token
+from .customer_analytics import clear_customer_analytics_cache
 from dotenv import load_dotenv
 import os, requests
 
@@ -124,6 +125,9 @@ async def get_customers_from_zoho() -> str:
                 db.customers.insert_one(populated_contact)
                 new_count += 1
 
+        if new_count or updated_count:
+            clear_customer_analytics_cache()
+
         return f"{new_count} new customers added, {updated_count} customers updated."
 
     except Exception as e: